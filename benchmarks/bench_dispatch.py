@@ -0,0 +1,141 @@
+"""Микробенчмарк диспетчеризации команд: строк скрипта в секунду.
+
+Обработчики в таблицах VFS_COMMANDS и BASIC_COMMANDS на время замера
+подменяются заглушками, поэтому меряется только путь строки скрипта до
+обработчика: чтение и strip, разбор в argv, поиск в таблице команд,
+блокировка VFS для команд записи и (с --log) запись в журнал.
+Результат печатается в JSON, как и в bench_vfs.py:
+
+    python benchmarks/bench_dispatch.py --lines 1000000 -o dispatch.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from bench_vfs import CommandLog, Session, VFS, git_commit, quiet
+
+import terminal
+
+# Смесь команд скрипта: каждая строка идёт через свой обработчик
+VFS_LINES = ['ls', 'ls /etc', 'cd /etc', 'cd ..', 'pwd', 'cat /etc/bashrc', 'du -s /',
+             'head -n 1 /etc/bashrc', 'find / -name ls', 'rm /tmp/x', 'chmod 755 /bin/ls']
+BASIC_LINES = ['ls', 'cd /tmp', 'echo hello world', '$HOME', 'rm x', 'chmod 755 x']
+
+
+@contextlib.contextmanager
+def stubbed_handlers():
+    """Подменяет все обработчики команд пустыми и восстанавливает их после замера"""
+    def stub(session, argv):
+        pass
+
+    saved = [(table, dict(table)) for table in (terminal.VFS_COMMANDS, terminal.BASIC_COMMANDS)]
+    try:
+        for table, _ in saved:
+            for name in table:
+                table[name] = stub
+        yield
+    finally:
+        for table, original in saved:
+            table.clear()
+            table.update(original)
+
+
+def write_script(path, lines, count):
+    """Скрипт из count строк, по кругу из lines, с комментарием и пустой строкой в начале"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# dispatch benchmark\n\n")
+        for index in range(count):
+            f.write(lines[index % len(lines)] + "\n")
+
+
+def run_script(session, path):
+    """Тот же цикл, что у Terminal._run_script в пакетном режиме: число выполненных строк"""
+    lines = 0
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                lines += 1
+                session.get_command(line)
+    return lines
+
+
+def bench_script(session, path, repeat):
+    """Лучший из repeat прогонов скрипта: строк в секунду"""
+    times = []
+    lines = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        lines = run_script(session, path)
+        times.append(time.perf_counter() - started)
+    best = min(times)
+    return {'lines': lines, 'seconds': best, 'seconds_all': times, 'lines_per_sec': lines / best}
+
+
+def build_tree(path):
+    """Маленькое дерево, чтобы у Session была VFS (команды записи берут её блокировку)"""
+    for directory in ('etc', 'bin', 'tmp'):
+        os.makedirs(os.path.join(path, directory))
+    with open(os.path.join(path, 'etc', 'bashrc'), 'w', encoding='utf-8') as f:
+        f.write("Instruction for bashrc\n")
+    with open(os.path.join(path, 'bin', 'ls'), 'w', encoding='utf-8') as f:
+        f.write("ls\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command dispatch lines-per-second benchmark with JSON output")
+    parser.add_argument('--lines', type=int, default=1_000_000, help="Lines in the generated script")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (the best is reported)")
+    parser.add_argument('--log', action='store_true', help="Also measure with a CommandLog attached")
+    parser.add_argument('--output', '-o', help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vfs-dispatch-')
+    try:
+        tree = os.path.join(workdir, 'tree')
+        build_tree(tree)
+        with quiet():
+            vfs = VFS(tree)
+        scripts = {'vfs': os.path.join(workdir, 'vfs.sh'), 'basic': os.path.join(workdir, 'basic.sh')}
+        write_script(scripts['vfs'], VFS_LINES, args.lines)
+        write_script(scripts['basic'], BASIC_LINES, args.lines)
+
+        results = {}
+        with stubbed_handlers():
+            for mode, path in scripts.items():
+                target = vfs if mode == 'vfs' else None
+                results[mode] = {'log_off': bench_script(Session(target, user='bench'), path, args.repeat)}
+                if args.log:
+                    log = CommandLog(os.path.join(workdir, f"{mode}.csv"))
+                    try:
+                        results[mode]['log_on'] = bench_script(Session(target, user='bench', log=log),
+                                                               path, args.repeat)
+                    finally:
+                        log.close()
+
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {key: value for key, value in vars(args).items() if key != 'output'},
+            'dispatch': results,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
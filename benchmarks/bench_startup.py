@@ -0,0 +1,130 @@
+"""Замеры холодного старта terminal.py.
+
+Импорт модуля меряется через python -X importtime, запуск — по настенным часам:
+процесс python terminal.py --batch со скриптом из одной команды над синтетическим
+деревом, с обычной, ленивой и фоновой (--vfs-background) загрузкой VFS.
+Результат печатается в JSON, как и в bench_vfs.py:
+
+    python benchmarks/bench_startup.py --width 8 --depth 3 --files 30 -o startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_vfs import ROOT, generate_tree, git_commit
+
+TERMINAL = os.path.join(ROOT, 'terminal.py')
+
+# Режимы загрузки VFS: имя -> дополнительные аргументы terminal.py
+MODES = {
+    'eager': [],
+    'lazy': ['--vfs-lazy'],
+    'background': ['--vfs-background'],
+}
+
+
+def import_time(repeat):
+    """Время импорта terminal по -X importtime (лучший прогон): всего, собственное
+    и самые дорогие модули, которые он тянет за собой"""
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import terminal'], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        modules = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), int(own), int(cumulative)))
+        total = next(cumulative for name, own, cumulative in modules if name == 'terminal')
+        if best is None or total < best[0]:
+            best = (total, modules)
+    total, modules = best
+    # Модули, импортированные ради terminal: всё, что напечатано после site
+    names = [name for name, _, _ in modules]
+    start = names.index('site') + 1 if 'site' in names else 0
+    own_modules = sorted(modules[start:], key=lambda module: module[1], reverse=True)
+    return {
+        'terminal_us': total,
+        'terminal_self_us': next(own for name, own, _ in modules if name == 'terminal'),
+        'modules': len(modules) - start,
+        'top_self_us': {name: own for name, own, _ in own_modules[:10]},
+    }
+
+
+def wall_clock(argv, repeat):
+    """Настенное время процесса: лучший и медианный прогон из repeat (после прогрева).
+    Если команда не работает (например, у старого коммита нет такой опции), возвращает ошибку"""
+    warmup = subprocess.run(argv, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if warmup.returncode != 0:
+        return {'error': f"exit status {warmup.returncode}"}
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(argv, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - started)
+    return {'best_s': min(times), 'median_s': statistics.median(times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmarks with JSON output")
+    parser.add_argument('--width', type=int, default=8, help="Subdirectories per directory")
+    parser.add_argument('--depth', type=int, default=3, help="Directory levels below the root")
+    parser.add_argument('--files', type=int, default=30, help="Files per directory")
+    parser.add_argument('--file-size', type=int, default=2048, help="Mean file size in bytes")
+    parser.add_argument('--size-dist', default='lognormal', help="File size distribution (see bench_vfs.py)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement")
+    parser.add_argument('--tree', help="Use (and keep) this directory instead of a temporary tree")
+    parser.add_argument('--output', '-o', help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vfs-startup-')
+    tree = args.tree or os.path.join(workdir, 'tree')
+    try:
+        if not os.path.isdir(tree):
+            generate_tree(tree, args.width, args.depth, args.files, args.file_size, args.size_dist, args.seed)
+        # Первая команда не трогает дерево; вторая читает файл в самой глубокой директории
+        deep = '/'.join(['dir_0'] * args.depth + ['file_0.txt'])
+        scripts = {'pwd': 'pwd\n', 'cat_deep': f"cat /{deep}\n"}
+        for name, text in scripts.items():
+            with open(os.path.join(workdir, f"{name}.sh"), 'w', encoding='utf-8') as f:
+                f.write(text)
+
+        runs = {'python': wall_clock([sys.executable, '-c', 'pass'], args.repeat),
+                'import': wall_clock([sys.executable, '-c', 'import terminal'], args.repeat)}
+        for mode, options in MODES.items():
+            for name in scripts:
+                argv = [sys.executable, TERMINAL, '--batch', '--vfs', tree,
+                        '--script', os.path.join(workdir, f"{name}.sh")] + options
+                runs[f"{mode}_{name}"] = wall_clock(argv, args.repeat)
+
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {key: value for key, value in vars(args).items() if key != 'output'},
+            'importtime': import_time(args.repeat),
+            'wall_clock': runs,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
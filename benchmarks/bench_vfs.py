@@ -0,0 +1,238 @@
+"""Замеры производительности VFS: загрузка дерева, поиск узлов и выполнение команд.
+
+Скрипт генерирует синтетическое дерево заданной формы, замеряет
+VFS.load_vfs (время и пиковую память), get_node на разной глубине и
+пропускную способность get_command для сценариев ls/cd/cat с журналом и без.
+Результат печатается в JSON, чтобы сравнивать прогоны между коммитами:
+
+    python benchmarks/bench_vfs.py --width 8 --depth 3 --files 20 -o before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from terminal import VFS, Session, CommandLog  # noqa: E402
+
+# Распределения размеров файлов: имя -> функция (генератор, средний размер) -> размер
+SIZE_DISTRIBUTIONS = {
+    'fixed': lambda rng, mean: mean,
+    'uniform': lambda rng, mean: rng.randint(0, 2 * mean),
+    # Много маленьких файлов и редкие большие, как в реальных деревьях
+    'lognormal': lambda rng, mean: min(int(rng.lognormvariate(0, 1.0) * mean / 1.65), 64 * mean),
+}
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'vfs', 'node', 'path', 'cache', 'log', 'terminal']
+
+
+def generate_tree(path, width, depth, files, file_size, distribution, seed):
+    """Создаёт дерево: в каждой директории files файлов и width поддиректорий,
+    всего depth уровней под корнем. Возвращает (число файлов, число директорий, байт)"""
+    rng = random.Random(seed)
+    sizer = SIZE_DISTRIBUTIONS[distribution]
+    # Один блок текста на всё дерево: файлы — его срезы
+    text = ''.join(f"{' '.join(rng.choices(WORDS, k=8))}\n" for _ in range(4096))
+    while len(text) < 64 * file_size:
+        text += text
+    totals = [0, 0, 0]
+
+    def fill(directory, level):
+        os.makedirs(directory, exist_ok=True)
+        totals[1] += 1
+        for index in range(files):
+            size = sizer(rng, file_size)
+            start = rng.randrange(len(text) - size) if size < len(text) else 0
+            with open(os.path.join(directory, f"file_{index}.txt"), 'w', encoding='utf-8') as f:
+                f.write(text[start:start + size])
+            totals[0] += 1
+            totals[2] += size
+        if level < depth:
+            for index in range(width):
+                fill(os.path.join(directory, f"dir_{index}"), level + 1)
+
+    fill(path, 0)
+    return tuple(totals)
+
+
+def quiet():
+    """VFS и команды печатают служебные сообщения — на время замеров глушим их"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_load(path, repeat, **options):
+    """Время VFS(...) (лучшее из repeat) и пиковая память по tracemalloc (отдельный прогон)"""
+    times = []
+    for _ in range(repeat):
+        with quiet():
+            started = time.perf_counter()
+            VFS(path, **options)
+            times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    with quiet():
+        vfs = VFS(path, **options)
+        if options.get('lazy'):
+            # Для ленивого режима считаем память полностью догруженного дерева
+            stack = [vfs.filesystem]
+            while stack:
+                node = vfs._ensure_loaded(stack.pop())
+                if node.type == 'directory':
+                    stack.extend(node.content.values())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': min(times), 'seconds_all': times, 'peak_bytes': peak}
+
+
+def paths_by_depth(vfs):
+    """Пути всех узлов дерева, сгруппированные по глубине (корень — 0)"""
+    levels = {}
+    stack = [('/', vfs.filesystem, 0)]
+    while stack:
+        path, node, level = stack.pop()
+        levels.setdefault(level, []).append(path)
+        if node.type == 'directory':
+            prefix = path.rstrip('/') + '/'
+            for name, child in node.content.items():
+                stack.append((prefix + name, child, level + 1))
+    return levels
+
+
+def bench_lookup(vfs, lookups, seed):
+    """get_node: поиск по кэшу путей (warm) и с пустым кэшем (cold) на каждой глубине"""
+    rng = random.Random(seed)
+    results = {}
+    for level, paths in sorted(paths_by_depth(vfs).items()):
+        sample = [rng.choice(paths) for _ in range(lookups)]
+        vfs._path_cache.clear()
+        started = time.perf_counter()
+        for path in sample:
+            vfs._path_cache.clear()
+            vfs.get_node(path)
+        cold = time.perf_counter() - started
+        for path in sample:
+            vfs.get_node(path)
+        started = time.perf_counter()
+        for path in sample:
+            vfs.get_node(path)
+        warm = time.perf_counter() - started
+        results[str(level)] = {'nodes': len(paths), 'cold_per_sec': lookups / cold,
+                               'warm_per_sec': lookups / warm}
+    return results
+
+
+def build_script(vfs, kind, count, seed):
+    """Сценарий из count команд: ls по директориям, cd по дереву или cat файлов"""
+    rng = random.Random(seed)
+    levels = paths_by_depth(vfs)
+    everything = [path for paths in levels.values() for path in paths]
+    directories = [path for path in everything if vfs.get_node(path).type == 'directory']
+    files = [path for path in everything if vfs.get_node(path).type == 'file']
+    if kind == 'ls':
+        return [f"ls {rng.choice(directories)}" for _ in range(count)]
+    if kind == 'cd':
+        return [f"cd {rng.choice(directories)}" if index % 2 == 0 else "cd .." for index in range(count)]
+    return [f"cat {rng.choice(files)}" for _ in range(count)]
+
+
+def bench_commands(vfs, count, seed, log_path):
+    """Команд в секунду для ls, cd и cat без журнала и с CommandLog"""
+    results = {}
+    with open(os.devnull, 'w') as devnull:
+        for kind in ('ls', 'cd', 'cat'):
+            script = build_script(vfs, kind, count, seed)
+            results[kind] = {}
+            for logging in (False, True):
+                log = CommandLog(log_path) if logging else None
+                session = Session(vfs, user='bench', log=log, out=devnull)
+                started = time.perf_counter()
+                for line in script:
+                    session.get_command(line)
+                elapsed = time.perf_counter() - started
+                if log:
+                    log.close()
+                results[kind]['log_on' if logging else 'log_off'] = {
+                    'commands': count, 'seconds': elapsed, 'per_sec': count / elapsed}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VFS benchmarks with JSON output")
+    parser.add_argument('--width', type=int, default=6, help="Subdirectories per directory")
+    parser.add_argument('--depth', type=int, default=3, help="Directory levels below the root")
+    parser.add_argument('--files', type=int, default=20, help="Files per directory")
+    parser.add_argument('--file-size', type=int, default=2048, help="Mean file size in bytes")
+    parser.add_argument('--size-dist', choices=sorted(SIZE_DISTRIBUTIONS), default='lognormal',
+                        help="File size distribution")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help="Load runs (the best time is reported)")
+    parser.add_argument('--lookups', type=int, default=20000, help="get_node lookups per depth")
+    parser.add_argument('--commands', type=int, default=5000, help="Commands per ls/cd/cat script")
+    parser.add_argument('--lazy', action='store_true', help="Also measure --vfs-lazy loading")
+    parser.add_argument('--workers', type=int, default=0, help="Also measure parallel loading with N workers")
+    parser.add_argument('--tree', help="Use (and keep) this directory instead of a temporary tree")
+    parser.add_argument('--output', '-o', help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vfs-bench-')
+    tree = args.tree or os.path.join(workdir, 'tree')
+    try:
+        if args.tree and os.path.isdir(tree):
+            shape = None  # Готовое дерево: форму не знаем
+        else:
+            started = time.perf_counter()
+            files, dirs, size = generate_tree(tree, args.width, args.depth, args.files, args.file_size,
+                                              args.size_dist, args.seed)
+            shape = {'files': files, 'directories': dirs, 'bytes': size,
+                     'generate_seconds': time.perf_counter() - started}
+
+        load = {'eager': bench_load(tree, args.repeat)}
+        if args.lazy:
+            load['lazy'] = bench_load(tree, args.repeat, lazy=True)
+        if args.workers:
+            load[f'workers_{args.workers}'] = bench_load(tree, args.repeat, workers=args.workers)
+
+        with quiet():
+            vfs = VFS(tree)
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {key: value for key, value in vars(args).items() if key != 'output'},
+            'tree': shape,
+            'load': load,
+            'get_node': bench_lookup(vfs, args.lookups, args.seed),
+            'commands': bench_commands(vfs, args.commands, args.seed, os.path.join(workdir, 'log.csv')),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Нагрузочная проверка конкурентного доступа к общей VFS.
+
+Несколько потоков-читателей выполняют ls, du, find и cat через свои Session,
+а поток-писатель по кругу делает cp -r, chmod, mv и rm над тем же деревом.
+Читатель не должен увидеть наполовину изменённую директорию, исключение
+или узел, уже удалённый из дерева. Результат печатается в JSON; при ошибках
+код возврата 1:
+
+    python benchmarks/stress_vfs.py --readers 16 --seconds 5 --lazy
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from bench_vfs import VFS, Session, git_commit
+
+BASHRC = "Instruction for bashrc"
+
+
+def build_tree(path, files):
+    """Дерево для проверки: /big с files файлами, /etc/bashrc и /bin/ls"""
+    for directory in ('big', 'etc', 'bin'):
+        os.makedirs(os.path.join(path, directory))
+    for index in range(files):
+        with open(os.path.join(path, 'big', f"f{index}"), 'w', encoding='utf-8') as f:
+            f.write(f"file {index}\n")
+    with open(os.path.join(path, 'etc', 'bashrc'), 'w', encoding='utf-8') as f:
+        f.write(BASHRC)
+    with open(os.path.join(path, 'bin', 'ls'), 'w', encoding='utf-8') as f:
+        f.write("ls\n")
+
+
+def writer(vfs, stop, counts, errors):
+    """Цикл изменений дерева: копия /big переименовывается, меняется и удаляется"""
+    while not stop.is_set():
+        try:
+            vfs.cp('/big', '/copy', recursive=True)
+            vfs.chmod('/copy/f1', '600')
+            vfs.mv('/copy', '/moved')
+            vfs.rm('/moved/f2')
+            vfs.mv('/bin/ls', '/bin/ls2')
+            vfs.mv('/bin/ls2', '/bin/ls')
+            vfs.rm('/moved', recursive=True)
+            counts['write_cycles'] += 1
+        except Exception:
+            errors.append(traceback.format_exc())
+            stop.set()
+
+
+def reader(vfs, files, stop, counts, errors):
+    """Команды чтения; /big не меняется, поэтому его вывод проверяется точно"""
+    session = Session(vfs, user='stress')
+    while not stop.is_set():
+        try:
+            for line in ('ls /', 'ls /big', 'ls /moved', 'du -s /', 'find / -name f1', 'cat /etc/bashrc'):
+                output = session.execute(line).output
+                if line == 'cat /etc/bashrc' and output != BASHRC + '\n':
+                    raise AssertionError(f"{line}: {output!r}")
+                if line == 'ls /big' and output.count('\n') != files:
+                    raise AssertionError(f"{line}: {output.count(chr(10))} entries instead of {files}")
+                if 'error' in output.lower():
+                    raise AssertionError(f"{line}: {output}")
+            node = vfs.get_node('/bin/ls') or vfs.get_node('/bin/ls2')
+            if node is not None and vfs.virtual_path(node) is None:
+                raise AssertionError("get_node returned a node that is no longer in the tree")
+            for _ in vfs._iter_subtree(vfs.filesystem):
+                pass
+            counts['read_rounds'] += 1
+        except Exception:
+            errors.append(traceback.format_exc())
+            stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent readers and a writer over one shared VFS")
+    parser.add_argument('--readers', type=int, default=16, help="Reader threads")
+    parser.add_argument('--seconds', type=float, default=5.0, help="How long to run")
+    parser.add_argument('--files', type=int, default=300, help="Files in the /big directory")
+    parser.add_argument('--lazy', action='store_true', help="Load the VFS with --vfs-lazy")
+    parser.add_argument('--background', action='store_true', help="Load the VFS with --vfs-background")
+    parser.add_argument('--output', '-o', help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vfs-stress-')
+    try:
+        build_tree(workdir, args.files)
+        with contextlib.redirect_stdout(io.StringIO()):
+            vfs = VFS(workdir, lazy=args.lazy, background=args.background)
+        stop = threading.Event()
+        counts = {'read_rounds': 0, 'write_cycles': 0}
+        errors = []
+        threads = [threading.Thread(target=writer, args=(vfs, stop, counts, errors))]
+        threads += [threading.Thread(target=reader, args=(vfs, args.files, stop, counts, errors))
+                    for _ in range(args.readers)]
+        # Частое переключение потоков, чтобы гонки проявлялись чаще
+        sys.setswitchinterval(1e-5)
+        for thread in threads:
+            thread.start()
+        stop.wait(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        **counts,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
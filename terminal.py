@@ -1,17 +1,411 @@
+import io
 import os
-import argparse
-import csv
-from datetime import datetime
-from pathlib import Path
+import sys
+import time
+import atexit
+import mmap
+import struct
+import functools
+from collections import OrderedDict
+from array import array
+import threading
+# argparse, csv, re, fnmatch и shutil импортируются там, где нужны:
+# от них зависит только часть команд, а импорт модуля должен быть быстрым
+
+# До Python 3.13 каждое отображение mmap держит свою копию дескриптора файла
+MMAP_TRACKFD = sys.version_info < (3, 13)
+MMAP_OPTIONS = {} if MMAP_TRACKFD else {'trackfd': False}
+
+class Node:
+    """Базовый узел VFS. Вместо словаря с ключами используются __slots__,
+    а физический путь не хранится, а вычисляется по цепочке родителей"""
+    __slots__ = ('name', 'parent', 'origin', 'permissions', 'owner', 'group', 'mtime')
+    type = None
+    
+    def __init__(self, name, parent, permissions, owner, group, origin=None):
+        self.name = name
+        self.parent = parent
+        self.origin = origin  # Физический путь задаётся явно только у корня
+        self.permissions = permissions
+        self.owner = owner
+        self.group = group
+        self.mtime = None  # st_mtime_ns на момент чтения с диска (None — неизвестно)
+    
+    @property
+    def path(self):
+        """Физический путь узла"""
+        if self.origin is not None:
+            return self.origin
+        return os.path.join(self.parent.path, self.name)
+
+
+class FileNode(Node):
+    """Файл VFS: content — текст файла (None, пока не прочитан в ленивом режиме)"""
+    __slots__ = ('content', 'size')
+    type = 'file'
+    
+    def __init__(self, name, parent, permissions, owner, group, content=None, size=0, origin=None):
+        super().__init__(name, parent, permissions, owner, group, origin)
+        self.content = content
+        self.size = size
+
+
+class DirNode(Node):
+    """Директория VFS: content — словарь имя -> узел.
+    Опубликованный словарь content никогда не меняется на месте: изменения
+    собирают новый словарь и подменяют ссылку (copy-on-write), поэтому читатели
+    обходят его без блокировок и видят состояние директории до или после изменения.
+    total_size и file_count — суммарный размер и число файлов во всём поддереве;
+    они поддерживаются инкрементально при загрузке и изменениях дерева"""
+    __slots__ = ('content', 'loaded', 'total_size', 'file_count')
+    type = 'directory'
+    
+    def __init__(self, name, parent, permissions, owner, group, origin=None):
+        super().__init__(name, parent, permissions, owner, group, origin)
+        self.content = {}
+        self.loaded = True
+        self.total_size = 0
+        self.file_count = 0
+
+
+class TrigramIndex:
+    """Инвертированный индекс триграмм по содержимому файлов для grep.
+    Триграммы берутся из текста в нижнем регистре, поэтому индекс подходит
+    и для поиска с -i. Отображённые через mmap и ещё не прочитанные файлы
+    не индексируются и всегда остаются кандидатами"""
+    
+    def __init__(self):
+        self.postings = {}  # Триграмма -> множество файловых узлов
+        self.unindexed = set()
+    
+    @staticmethod
+    def trigrams(text):
+        text = text.lower()
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def add(self, node):
+        if isinstance(node.content, str):
+            for trigram in self.trigrams(node.content):
+                self.postings.setdefault(trigram, set()).add(node)
+        else:
+            self.unindexed.add(node)
+    
+    def discard(self, node):
+        if node in self.unindexed:
+            self.unindexed.discard(node)
+            return
+        if isinstance(node.content, str):
+            for trigram in self.trigrams(node.content):
+                nodes = self.postings.get(trigram)
+                if nodes is not None:
+                    nodes.discard(node)
+                    if not nodes:
+                        del self.postings[trigram]
+    
+    def candidates(self, literal):
+        """Файлы, которые могут содержать literal; None — индекс не помогает
+        (строка короче трёх символов)"""
+        trigrams = self.trigrams(literal)
+        if not trigrams:
+            return None
+        postings = sorted((self.postings.get(trigram, set()) for trigram in trigrams), key=len)
+        result = set(postings[0])
+        for nodes in postings[1:]:
+            result &= nodes
+            if not result:
+                break
+        return result | self.unindexed
+
+
+@functools.lru_cache(maxsize=64)
+def _text_probe(regex):
+    """Выражение для быстрой проверки всего текста сразу: совпадает везде, где regex
+    совпал бы в какой-нибудь строке (^ и $ — на границах строк, а не файла).
+    None — для \\A, \\Z и lookaround такой проверки нет"""
+    import re
+    
+    pattern = regex.pattern
+    marks = ('\\A', '\\Z', '(?=', '(?!', '(?<')
+    if isinstance(pattern, bytes):
+        marks = tuple(mark.encode('ascii') for mark in marks)
+    if any(mark in pattern for mark in marks):
+        return None
+    return re.compile(pattern, regex.flags | re.MULTILINE)
+
+
+def grep_text(regex, text):
+    """Строки text, в которых есть совпадение с regex: список (номер строки, строка).
+    text — str или mmap (тогда regex должен быть байтовым)"""
+    probe = _text_probe(regex)
+    if probe is not None and probe.search(text) is None:
+        return []
+    if isinstance(text, str):
+        return [(number, line) for number, line in enumerate(text.split('\n'), 1) if regex.search(line)]
+    
+    matches = []
+    position = number = 0
+    length = len(text)
+    while position < length:
+        end = text.find(b'\n', position)
+        if end < 0:
+            end = length
+        number += 1
+        line = text[position:end]
+        if regex.search(line):
+            matches.append((number, line.decode('utf-8', 'ignore')))
+        position = end + 1
+    return matches
+
+
+def _grep_worker(pattern, flags, items):
+    """Задача пула процессов: ищет pattern в списке (путь, текст)"""
+    import re
+    
+    regex = re.compile(pattern, flags)
+    return [(path, number, line) for path, text in items for number, line in grep_text(regex, text)]
+
+
+class WritebackJournal:
+    """Журнал изменений VFS для режима --vfs-writeback.
+    rm, chmod, cp и mv только добавляют запись в журнал; отдельный поток
+    раз в interval секунд (или при накоплении BATCH_SIZE записей) применяет
+    их к физической директории одним проходом. Подряд идущие chmod одного пути
+    схлопываются в один os.chmod. Пакет применяется под блокировкой VFS,
+    поэтому команды не видят дерево посреди переименования на диске"""
+    INTERVAL = 0.5
+    BATCH_SIZE = 1024
+    
+    def __init__(self, root, lock, interval=INTERVAL):
+        self.root = root
+        self.lock = lock  # Блокировка дерева VFS
+        self.interval = interval
+        self.ops = []
+        self.applied = 0
+        self.failed = 0
+        self.errors = []  # Ошибки, о которых ещё не сообщили (sync или выход)
+        self.moved = set()  # Узлы с явным origin: их физический путь меняется при mv на диске
+        self._cond = threading.Condition()
+        self._closed = False
+        self.thread = threading.Thread(target=self._run, name="vfs-writeback", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+    
+    def physical(self, path):
+        """Физический путь для нормализованного пути VFS"""
+        return os.path.join(self.root, path.lstrip('/'))
+    
+    def append(self, *op):
+        with self._cond:
+            self.ops.append(op)
+            # Первая запись будит поток (он отсчитает interval), полный пакет — применяется сразу
+            if len(self.ops) == 1 or len(self.ops) >= self.BATCH_SIZE:
+                self._cond.notify()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self.ops and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Даём накопиться пакету, если только он уже не набран
+                if len(self.ops) < self.BATCH_SIZE:
+                    self._cond.wait(self.interval)
+            self.sync()
+    
+    def sync(self):
+        """Применяет все накопленные записи в текущем потоке. Возвращает их число"""
+        with self.lock:
+            with self._cond:
+                ops, self.ops = self.ops, []
+            modes = {}
+            for op in ops:
+                if op[0] == 'chmod':
+                    modes[op[1]] = op[2]
+                    continue
+                self._chmod_all(modes)
+                self._apply(*op)
+            self._chmod_all(modes)
+            self.applied += len(ops)
+            self._settle_moved()
+            return len(ops)
+    
+    def _settle_moved(self):
+        """Все записи применены, и диск повторяет дерево: узлам, чьё переименование
+        уже на диске, явный origin не нужен — путь снова берётся из дерева.
+        Так moved содержит только узлы с ещё не применёнными mv"""
+        for node in list(self.moved):
+            parent = node.parent
+            if parent is not None:
+                if node.origin != os.path.join(parent.path, node.name):
+                    continue  # mv завершился ошибкой: узел по-прежнему читается из старого места
+                node.origin = None
+            self.moved.discard(node)
+    
+    def _chmod_all(self, modes):
+        for path, mode in modes.items():
+            try:
+                os.chmod(self.physical(path), mode)
+            except OSError as e:
+                self._error(f"chmod {path}: {e}")
+        modes.clear()
+    
+    def _apply(self, name, source, target=None):
+        import shutil
+        
+        try:
+            if name == 'rm':
+                physical = self.physical(source)
+                if os.path.isdir(physical) and not os.path.islink(physical):
+                    shutil.rmtree(physical)
+                else:
+                    os.remove(physical)
+            elif name == 'cp':
+                physical = self.physical(source)
+                if os.path.isdir(physical):
+                    shutil.copytree(physical, self.physical(target))
+                else:
+                    shutil.copy2(physical, self.physical(target))
+            elif name == 'mv':
+                source, target = self.physical(source), self.physical(target)
+                os.replace(source, target)
+                # Узлы, которые читаются по явному физическому пути, следуют за переименованием
+                for node in self.moved:
+                    origin = node.origin
+                    if origin == source or origin.startswith(source + os.sep):
+                        node.origin = target + origin[len(source):]
+        except OSError as e:
+            self._error(f"{name} {source}: {e}")
+    
+    def _error(self, message):
+        self.failed += 1
+        self.errors.append(message)
+    
+    def take_errors(self):
+        """Возвращает накопленные ошибки и очищает список"""
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+    
+    def close(self):
+        """Применяет оставшиеся записи и останавливает поток"""
+        if not self._closed:
+            self.sync()
+            with self._cond:
+                self._closed = True
+                self._cond.notify()
+            for message in self.take_errors():
+                print(f"vfs-writeback: {message}")
+        atexit.unregister(self.close)
+    
+    def stats(self):
+        with self._cond:
+            pending = len(self.ops)
+        return {'pending': pending, 'applied': self.applied, 'errors': self.failed}
+
+
+def writer(method):
+    """Выполняет метод VFS под блокировкой писателей. Читатели её не берут"""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
+class DirChanges:
+    """Накопленные изменения одной директории для VFS.refresh: копия словаря детей
+    (создаётся при первом изменении) и разница итогов размера и числа файлов.
+    Индексы обновляются сразу, а content подменяется один раз, когда директория сверена"""
+    __slots__ = ('vfs', 'node', 'content', 'size', 'count')
+    
+    def __init__(self, vfs, node):
+        self.vfs = vfs
+        self.node = node
+        self.content = None
+        self.size = self.count = 0
+    
+    def _ensure_copy(self):
+        if self.content is None:
+            self.content = dict(self.node.content)
+        return self.content
+    
+    def add(self, name, child):
+        self._ensure_copy()[name] = child
+        self.vfs._index_subtree(child)
+        size, count = self.vfs._totals(child)
+        self.size += size
+        self.count += count
+    
+    def remove(self, name):
+        child = self._ensure_copy().pop(name)
+        child.parent = None
+        self.vfs._unindex_subtree(child)
+        size, count = self.vfs._totals(child)
+        self.size -= size
+        self.count -= count
+
 
 class VFS:
-    def __init__(self, physical_path):
+    # Сколько файлов читает одна задача параллельного загрузчика
+    FILE_BATCH = 256
+    
+    # Размер куска при потоковом выводе файлов
+    CHUNK_SIZE = 64 * 1024
+    # Сколько разрешённых путей хранит LRU-кэш get_node
+    PATH_CACHE_SIZE = 4096
+    # Сколько последних инвалидаций помнит кэш путей; более старые записи кэша считаются устаревшими
+    INVALIDATION_LOG = 64
+    # Файлы от этого размера (в байтах) отображаются в память, а не читаются в str
+    MMAP_THRESHOLD = 16 * 1024 * 1024
+    # Сколько отображений живёт одновременно, если каждое держит дескриптор (MMAP_TRACKFD);
+    # не больше четверти лимита открытых файлов процесса
+    MMAP_LIVE_LIMIT = 256
+    
+    # С какого суммарного объёма текста grep делит поиск между процессами
+    GREP_PARALLEL_BYTES = 8 * 1024 * 1024
+    
+    def __init__(self, physical_path=None, lazy=False, workers=0, snapshot=None, mmap_threshold=MMAP_THRESHOLD,
+                 grep_index=False, writeback=False, writeback_interval=WritebackJournal.INTERVAL, background=False):
         self.physical_path = physical_path
-        self.filesystem = {}  # Здесь будет храниться вся VFS в памяти
+        # В ленивом режиме каталоги и файлы читаются по первому обращению.
+        # Фоновая загрузка — тот же ленивый режим, который дочитывает дерево отдельным потоком
+        self.lazy = lazy or background
+        self.workers = workers  # Число потоков параллельного загрузчика (0 — последовательно)
+        self.snapshot = snapshot  # Бинарный снимок, из которого восстанавливается дерево
+        self.mmap_threshold = mmap_threshold  # 0 — не использовать mmap
+        self._mapped = OrderedDict()  # LRU узлов с живым отображением (только при MMAP_TRACKFD)
+        self._mapped_limit = None  # Вычисляется при первом отображении
+        self.filesystem = None  # Здесь будет храниться вся VFS в памяти
+        self._path_cache = OrderedDict()  # Нормализованный путь -> (узел, версия последней проверки)
+        # Последние инвалидации: кортеж (версия, путь, префикс поддерева), заменяется целиком
+        self._invalidations = ()
+        self.name_index = {}  # Имя -> множество узлов с таким именем (для find)
+        self.perm_index = {}  # Права доступа -> множество узлов
+        self.use_grep_index = grep_index  # Строить ли TrigramIndex для grep
+        self.grep_index = None  # Строится при первом grep и дальше поддерживается
+        # Пути, изменённые в памяти: путь -> (поддерево принадлежит VFS, mtime на диске при изменении)
+        self.edits = {}
+        # Блокировка писателей: rm, cp, mv, chmod, refresh, сохранение снимка и ленивая догрузка выполняются по одному
+        self.lock = threading.RLock()
+        self.version = 0  # Растёт при каждом изменении структуры дерева (для кэша путей)
         self.load_vfs()
+        # В режиме write-back изменения дерева записываются в журнал и применяются к диску
+        self.journal = WritebackJournal(self.physical_path, self.lock, writeback_interval) if writeback else None
+        self.loader = None
+        if background and self.lazy:
+            self.loader = threading.Thread(target=self._load_background, name="vfs-loader", daemon=True)
+            self.loader.start()
     
     def load_vfs(self):
         """Рекурсивно загружает всю структуру директории в память"""
+        if self.snapshot:
+            print(f"Loading VFS snapshot: {self.snapshot}")
+            self.filesystem = self._load_snapshot(self.snapshot)
+            self._index_subtree(self.filesystem)
+            print("VFS loaded successfully into memory!")
+            return
+        
         if not os.path.exists(self.physical_path):
             raise FileNotFoundError(f"VFS path not found: {self.physical_path}")
         
@@ -19,130 +413,933 @@ class VFS:
             raise ValueError(f"VFS path is not a directory: {self.physical_path}")
         
         print(f"Loading VFS from: {self.physical_path}")
-        self.filesystem = self._load_directory(self.physical_path)
+        root = self._directory_node(os.path.basename(self.physical_path), None,
+                                    os.stat(self.physical_path), origin=self.physical_path)
+        if self.workers > 0 and not self.lazy:
+            self._load_tree_parallel(root)
+            self._compute_totals(root)
+        elif self.lazy:
+            root.loaded = False
+        else:
+            self._populate_directory(root)
+        self.filesystem = root
+        self._index_subtree(root)
         print("VFS loaded successfully into memory!")
     
-    def _load_directory(self, current_path):
+    def _load_directory(self, name, parent):
         """Рекурсивно загружает директорию и все её содержимое"""
-        # Получаем информацию о правах доступа
-        stat_info = os.stat(current_path)
-        permissions = stat_info.st_mode & 0o777  # Получаем только права доступа
-        
-        vfs_node = {
-            'type': 'directory',
-            'content': {},
-            'path': current_path,
-            'name': os.path.basename(current_path),
-            'permissions': permissions,
-            'owner': stat_info.st_uid,
-            'group': stat_info.st_gid
-        }
+        vfs_node = self._directory_node(name, parent, os.stat(os.path.join(parent.path, name)))
+        
+        if self.lazy:
+            # Содержимое будет прочитано при первом обращении через get_node
+            vfs_node.loaded = False
+        else:
+            self._populate_directory(vfs_node)
+        
+        return vfs_node
+    
+    def _directory_node(self, name, parent, stat_info, origin=None):
+        """Создаёт пустой узел директории по данным stat"""
+        node = DirNode(name, parent,
+                       stat_info.st_mode & 0o777,  # Получаем только права доступа
+                       stat_info.st_uid, stat_info.st_gid, origin)
+        node.mtime = stat_info.st_mtime_ns
+        return node
+    
+    def _load_tree_parallel(self, root):
+        """Загружает дерево пулом потоков: каталоги сканируются через os.scandir,
+        файлы читаются пакетами по FILE_BATCH"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        lock = threading.Lock()
+        finished = threading.Event()
+        pending = [0]
+        
+        def run(task, arg):
+            try:
+                task(arg, submit)
+            except Exception as e:
+                print(f"Error loading VFS: {e}")
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        finished.set()
         
+        def submit(task, arg):
+            with lock:
+                pending[0] += 1
+            pool.submit(run, task, arg)
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            submit(self._scan_directory, root)
+            finished.wait()
+        return root
+    
+    def _scan_directory(self, vfs_node, submit):
+        """Сканирует одну директорию, используя stat из DirEntry.
+        Поддиректории и пакеты файлов отправляются в пул через submit"""
+        current_path = vfs_node.path
+        files = []
+        try:
+            with os.scandir(current_path) as entries:
+                for entry in entries:
+                    try:
+                        stat_info = entry.stat()
+                    except PermissionError:
+                        print(f"Permission denied reading file: {entry.path}")
+                        vfs_node.content[entry.name] = self._error_file_node(entry.name, vfs_node, '[PERMISSION DENIED]')
+                        continue
+                    except Exception as e:
+                        print(f"Error reading file {entry.path}: {e}")
+                        vfs_node.content[entry.name] = self._error_file_node(entry.name, vfs_node, f'[ERROR: {str(e)}]')
+                        continue
+                    
+                    if entry.is_dir():
+                        child = self._directory_node(entry.name, vfs_node, stat_info)
+                        vfs_node.content[entry.name] = child
+                        submit(self._scan_directory, child)
+                    else:
+                        # Ключ создаётся сразу, чтобы сохранить порядок как у os.listdir;
+                        # содержимое заполнит задача чтения пакета
+                        child = FileNode(entry.name, vfs_node, stat_info.st_mode & 0o777,
+                                         stat_info.st_uid, stat_info.st_gid)
+                        child.mtime = stat_info.st_mtime_ns
+                        vfs_node.content[entry.name] = child
+                        files.append(child)
+        except PermissionError:
+            print(f"Permission denied reading: {current_path}")
+        except Exception as e:
+            print(f"Error reading {current_path}: {e}")
+        
+        vfs_node.loaded = True
+        for i in range(0, len(files), self.FILE_BATCH):
+            submit(self._read_file_batch, files[i:i + self.FILE_BATCH])
+    
+    def _read_file_batch(self, file_nodes, submit):
+        """Читает содержимое пакета файловых узлов"""
+        for node in file_nodes:
+            file_path = node.path
+            try:
+                node.content, node.size = self._read_file(file_path)
+            except PermissionError:
+                print(f"Permission denied reading file: {file_path}")
+                self._mark_unreadable(node, '[PERMISSION DENIED]')
+            except Exception as e:
+                print(f"Error reading file {file_path}: {e}")
+                self._mark_unreadable(node, f'[ERROR: {str(e)}]')
+    
+    def _populate_directory(self, vfs_node):
+        """Читает список элементов директории и заполняет узел.
+        Словарь собирается отдельно и публикуется целиком"""
+        current_path = vfs_node.path
+        content = {}
         try:
             for item_name in os.listdir(current_path):
                 item_path = os.path.join(current_path, item_name)
                 
                 if os.path.isdir(item_path):
                     # Рекурсивно загружаем поддиректорию
-                    vfs_node['content'][item_name] = self._load_directory(item_path)
+                    content[item_name] = self._load_directory(item_name, vfs_node)
                 else:
                     # Загружаем файл в память
-                    vfs_node['content'][item_name] = self._load_file(item_path)
+                    content[item_name] = self._load_file(item_name, vfs_node)
                     
         except PermissionError:
             print(f"Permission denied reading: {current_path}")
         except Exception as e:
             print(f"Error reading {current_path}: {e}")
+        vfs_node.content = content
         
-        return vfs_node
+        # Поддиректории к этому моменту уже посчитаны (или ещё не загружены и равны нулю)
+        vfs_node.total_size, vfs_node.file_count = self._sum_children(vfs_node)
+        vfs_node.loaded = True
+    
+    def _ensure_loaded(self, node):
+        """Догружает содержимое директории в ленивом режиме"""
+        if node.type == 'directory' and not node.loaded:
+            with self.lock:
+                # Другой поток мог загрузить директорию, пока мы ждали блокировку
+                if not node.loaded:
+                    self._populate_directory(node)
+                    if node.parent is not None:
+                        self._add_totals(node.parent, node.total_size, node.file_count)
+                    for child in node.content.values():
+                        self._index_add(child)
+        return node
+    
+    def _load_background(self):
+        """Дочитывает всё дерево (--vfs-background): директории и содержимое файлов.
+        Блокировка берётся на каждый узел отдельно, поэтому команда, которой нужна
+        ещё не загруженная часть дерева, ждёт не всю загрузку, а только эту часть"""
+        stack = [self.filesystem]
+        while stack:
+            node = stack.pop()
+            if node.type == 'directory':
+                self._ensure_loaded(node)
+                stack.extend(node.content.values())
+            elif node.content is None:
+                if MMAP_TRACKFD and self.mmap_threshold and node.size >= self.mmap_threshold:
+                    continue  # Большой файл отобразится при первом обращении
+                with self.lock:
+                    self._read_lazy(node, quiet=True)
+        with self.lock:
+            # Пока шла загрузка, cp -r мог скопировать ещё не прочитанную директорию
+            self.load_subtree(self.filesystem)
+            self.lazy = False
     
-    def _load_file(self, file_path):
+    def load_subtree(self, node):
+        """Догружает все директории поддерева (без чтения содержимого файлов)"""
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.type == 'directory':
+                self._ensure_loaded(current)
+                stack.extend(current.content.values())
+    
+    def _index_add(self, node, content=True):
+        """Добавляет узел в индексы имён и прав (и в индекс grep, если он построен)"""
+        self.name_index.setdefault(node.name, set()).add(node)
+        self.perm_index.setdefault(node.permissions, set()).add(node)
+        if content and self.grep_index is not None and node.type == 'file':
+            self.grep_index.add(node)
+    
+    def _index_discard(self, node, content=True):
+        """Убирает узел из индексов имён и прав (и из индекса grep)"""
+        for index, key in ((self.name_index, node.name), (self.perm_index, node.permissions)):
+            nodes = index.get(key)
+            if nodes is not None:
+                nodes.discard(node)
+                if not nodes:
+                    del index[key]
+        if content and self.grep_index is not None and node.type == 'file':
+            self.grep_index.discard(node)
+    
+    def _iter_subtree(self, node):
+        """Обходит узел и всё его загруженное поддерево"""
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            yield current
+            if current.type == 'directory':
+                stack.extend(current.content.values())
+    
+    def _index_subtree(self, node):
+        for current in self._iter_subtree(node):
+            self._index_add(current)
+    
+    def _unindex_subtree(self, node):
+        for current in self._iter_subtree(node):
+            self._index_discard(current)
+    
+    def virtual_path(self, node):
+        """Путь узла внутри VFS или None, если узел уже удалён из дерева"""
+        parts = []
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        if node is not self.filesystem:
+            return None
+        return "/" + "/".join(reversed(parts))
+    
+    def find(self, path="/", name=None, node_type=None, permissions=None):
+        """Ищет узлы под path по имени (точному или glob), типу и правам.
+        Кандидаты берутся из индексов, а не из обхода дерева"""
+        import fnmatch
+        
+        path = self.normalize_path(path)
+        start = self.get_node(path)
+        if start is None:
+            return None
+        if self.lazy:
+            self.load_subtree(start)
+        
+        if name is not None:
+            if any(char in name for char in '*?['):
+                # Шаблон сопоставляется с различными именами, а не со всеми узлами
+                candidates = set()
+                for key in fnmatch.filter(list(self.name_index), name):
+                    candidates |= self.name_index.get(key, set())
+            else:
+                candidates = set(self.name_index.get(name, ()))
+            if permissions is not None:
+                candidates &= self.perm_index.get(permissions, set())
+        elif permissions is not None:
+            candidates = set(self.perm_index.get(permissions, ()))
+        else:
+            candidates = set(self._iter_subtree(start))
+        
+        results = []
+        prefix = path.rstrip('/') + '/'
+        for node in candidates:
+            if node_type is not None and node.type != node_type:
+                continue
+            node_path = self.virtual_path(node)
+            if node_path is not None and (node_path == path or node_path.startswith(prefix)):
+                results.append(node_path)
+        results.sort()
+        return results
+    
+    def grep(self, path, pattern, recursive=False, ignore_case=False, workers=0):
+        """Ищет pattern (регулярное выражение) в файле path или, с recursive,
+        во всех файлах под директорией path.
+        Возвращает (True, [(путь, номер строки, строка), ...]) или (False, сообщение)"""
+        import re
+        
+        path = self.normalize_path(path)
+        start = self.get_node(path)
+        if start is None:
+            return False, f"{path}: No such file or directory"
+        if start.type == 'directory' and not recursive:
+            return False, f"{path}: Is a directory"
+        flags = re.IGNORECASE if ignore_case else 0
+        regex = re.compile(pattern, flags)
+        
+        if start.type == 'file':
+            files = [(path, start)]
+        else:
+            if self.lazy:
+                self.load_subtree(start)
+            candidates = None
+            if self.use_grep_index and not any(char in pattern for char in '.^$*+?{}[]\\|()'):
+                # Литерал: сужаем круг файлов по индексу триграмм до запуска regex
+                if self.grep_index is None:
+                    with self.lock:
+                        if self.grep_index is None:
+                            index = TrigramIndex()
+                            for node in self._iter_subtree(self.filesystem):
+                                if node.type == 'file':
+                                    index.add(node)
+                            self.grep_index = index
+                candidates = self.grep_index.candidates(pattern)
+            if candidates is None:
+                candidates = (node for node in self._iter_subtree(start) if node.type == 'file')
+            prefix = path.rstrip('/') + '/'
+            files = []
+            for node in candidates:
+                node_path = self.virtual_path(node)
+                if node_path is not None and node_path.startswith(prefix):
+                    files.append((node_path, node))
+            files.sort(key=lambda item: item[0])
+        
+        # Содержимое читается по одному файлу: отображения не копятся в списке все сразу
+        total = sum(node.size for _, node in files)
+        if workers > 1 and len(files) > 1 and total >= self.GREP_PARALLEL_BYTES:
+            return True, self._grep_parallel(pattern, flags, files, workers)
+        
+        matches = []
+        byte_regex = None
+        for node_path, node in files:
+            text = self.read_file(node)
+            if isinstance(text, str):
+                found = grep_text(regex, text)
+            else:
+                if byte_regex is None:
+                    byte_regex = re.compile(pattern.encode('utf-8'), flags)
+                found = grep_text(byte_regex, text)
+            matches.extend((node_path, number, line) for number, line in found)
+        return True, matches
+    
+    def _grep_parallel(self, pattern, flags, files, workers):
+        """Распределяет поиск по пулу процессов кусками примерно равного объёма.
+        Файлы, отображённые через mmap, просматриваются в текущем процессе по одному"""
+        import re
+        from concurrent.futures import ProcessPoolExecutor
+        
+        chunks = [[] for _ in range(workers * 4)]
+        sizes = [0] * len(chunks)
+        mapped = []
+        for node_path, node in files:
+            text = self.read_file(node)
+            if not isinstance(text, str):
+                mapped.append((node_path, node))
+                continue
+            smallest = sizes.index(min(sizes))
+            chunks[smallest].append((node_path, text))
+            sizes[smallest] += len(text)
+        
+        matches = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_grep_worker, pattern, flags, chunk) for chunk in chunks if chunk]
+            if mapped:
+                byte_regex = re.compile(pattern.encode('utf-8'), flags)
+                for node_path, node in mapped:
+                    found = grep_text(byte_regex, self.read_file(node))
+                    matches.extend((node_path, number, line) for number, line in found)
+            for future in futures:
+                matches.extend(future.result())
+        matches.sort(key=lambda match: (match[0], match[1]))
+        return matches
+    
+    def _totals(self, node):
+        """(размер, число файлов) для узла: у директории — по всему поддереву"""
+        if node.type == 'directory':
+            return node.total_size, node.file_count
+        return node.size, 1
+    
+    def _sum_children(self, node):
+        total_size = file_count = 0
+        for child in node.content.values():
+            size, count = self._totals(child)
+            total_size += size
+            file_count += count
+        return total_size, file_count
+    
+    def _add_totals(self, node, size, count):
+        """Прибавляет size и count к итогам директории node и всех её предков"""
+        while node is not None:
+            node.total_size += size
+            node.file_count += count
+            node = node.parent
+    
+    def _compute_totals(self, root):
+        """Пересчитывает итоги всех загруженных директорий снизу вверх"""
+        order = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.type == 'directory':
+                order.append(node)
+                stack.extend(node.content.values())
+        for node in reversed(order):
+            node.total_size, node.file_count = self._sum_children(node)
+    
+    def _load_file(self, name, parent):
         """Загружает содержимое файла в память"""
+        file_path = os.path.join(parent.path, name)
         try:
             # Получаем информацию о файле
             stat_info = os.stat(file_path)
             permissions = stat_info.st_mode & 0o777
             
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            return {
-                'type': 'file',
-                'content': content,
-                'size': len(content),
-                'path': file_path,
-                'name': os.path.basename(file_path),
-                'permissions': permissions,
-                'owner': stat_info.st_uid,
-                'group': stat_info.st_gid
-            }
+            if self.lazy:
+                # Содержимое будет прочитано при первом cat
+                content = None
+                size = stat_info.st_size
+            else:
+                content, size = self._read_file(file_path)
+            
+            node = FileNode(name, parent, permissions, stat_info.st_uid, stat_info.st_gid, content, size)
+            node.mtime = stat_info.st_mtime_ns
+            return node
             
         except PermissionError:
             print(f"Permission denied reading file: {file_path}")
-            return {
-                'type': 'file',
-                'content': '[PERMISSION DENIED]',
-                'size': 0,
-                'path': file_path,
-                'name': os.path.basename(file_path),
-                'permissions': 0o000,
-                'owner': 0,
-                'group': 0
-            }
+            return self._error_file_node(name, parent, '[PERMISSION DENIED]')
         except Exception as e:
             print(f"Error reading file {file_path}: {e}")
-            return {
-                'type': 'file',
-                'content': f'[ERROR: {str(e)}]',
-                'size': 0,
-                'path': file_path,
-                'name': os.path.basename(file_path),
-                'permissions': 0o000,
-                'owner': 0,
-                'group': 0
-            }
+            return self._error_file_node(name, parent, f'[ERROR: {str(e)}]')
+    
+    def _error_file_node(self, name, parent, message):
+        """Узел-заглушка для файла, который не удалось прочитать"""
+        return FileNode(name, parent, 0o000, 0, 0, message, 0)
+    
+    def _mark_unreadable(self, node, message):
+        """Превращает уже созданный файловый узел в заглушку"""
+        node.content = message
+        node.size = 0
+        node.permissions = 0o000
+        node.owner = 0
+        node.group = 0
+    
+    def _read_file(self, file_path, defer_map=True):
+        """Читает текст файла с диска и возвращает (содержимое, размер в байтах).
+        Размер всегда берётся с диска, а не из длины str, поэтому итоги du не зависят
+        от режима загрузки. Файлы больше mmap_threshold не копируются в память,
+        а отображаются через mmap. Если отображение держит дескриптор (MMAP_TRACKFD),
+        с defer_map оно откладывается до первого обращения: содержимое None"""
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.mmap_threshold and size >= self.mmap_threshold:
+                if defer_map and MMAP_TRACKFD:
+                    return None, size
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ, **MMAP_OPTIONS), size
+            return f.read(), size
+    
+    def _track_map(self, node):
+        """Запоминает узел с живым отображением. Сверх MMAP_LIVE_LIMIT самый давно
+        использованный узел забывает своё отображение (content снова None) и отобразит
+        файл заново при следующем обращении; дескриптор закрывается, когда
+        отображение больше никто не читает"""
+        if self._mapped_limit is None:
+            self._mapped_limit = self._mmap_live_limit()
+        mapped = self._mapped
+        mapped[node] = None
+        while len(mapped) > self._mapped_limit:
+            old = mapped.popitem(last=False)[0]
+            if isinstance(old.content, mmap.mmap):
+                old.content = None
+    
+    def _mmap_live_limit(self):
+        try:
+            import resource
+            soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        except (ImportError, OSError, ValueError):
+            return self.MMAP_LIVE_LIMIT
+        if soft == resource.RLIM_INFINITY:
+            return self.MMAP_LIVE_LIMIT
+        return max(1, min(self.MMAP_LIVE_LIMIT, soft // 4))
+    
+    def read_file(self, node):
+        """Возвращает содержимое файла, при необходимости читая его с диска"""
+        content = node.content
+        if content is None:
+            with self.lock:
+                return self._read_lazy(node)
+        if MMAP_TRACKFD and isinstance(content, mmap.mmap):
+            try:
+                self._mapped.move_to_end(node)
+            except KeyError:
+                pass  # Отображение создано не через _read_lazy (копия) или уже вытеснено
+        return content
+    
+    def _read_lazy(self, node, quiet=False):
+        """Читает отложенный файл под блокировкой; повторная проверка — другой поток мог успеть.
+        quiet — не печатать ошибки чтения (фоновая загрузка): их покажет cat"""
+        if node.content is None:
+            file_path = node.path
+            try:
+                node.content, size = self._read_file(file_path, defer_map=False)
+                if MMAP_TRACKFD and isinstance(node.content, mmap.mmap):
+                    self._track_map(node)
+                # Файл мог измениться на диске после stat при загрузке директории
+                if size != node.size and node.parent is not None:
+                    self._add_totals(node.parent, size - node.size, 0)
+                node.size = size
+                if self.grep_index is not None and node in self.grep_index.unindexed:
+                    self.grep_index.unindexed.discard(node)
+                    self.grep_index.add(node)
+            except PermissionError:
+                if not quiet:
+                    print(f"Permission denied reading file: {file_path}")
+                return '[PERMISSION DENIED]'
+            except Exception as e:
+                if not quiet:
+                    print(f"Error reading file {file_path}: {e}")
+                return f'[ERROR: {str(e)}]'
+        return node.content
+    
+    def iter_content(self, node, start=0, end=None):
+        """Отдаёт содержимое файла в диапазоне [start, end) кусками по CHUNK_SIZE.
+        Непрочитанные файлы (ленивый режим) читаются с диска только в этом диапазоне"""
+        content = node.content
+        if content is None:
+            yield from self._iter_disk(node.path, start, end)
+            return
+        
+        length = len(content)
+        end = length if end is None else min(end, length)
+        # Срезы memoryview не копируют отображённый файл целиком
+        view = memoryview(content) if isinstance(content, mmap.mmap) else content
+        for offset in range(start, end, self.CHUNK_SIZE):
+            yield view[offset:min(offset + self.CHUNK_SIZE, end)]
+    
+    def iter_bytes(self, node, start=0, end=None):
+        """Как iter_content, но смещения всегда в байтах UTF-8, в том числе у файла,
+        уже прочитанного в str (cat --range). Такой файл кодируется целиком —
+        большие файлы и так отображаются через mmap"""
+        content = node.content
+        if not isinstance(content, str):
+            yield from self.iter_content(node, start, end)
+            return
+        
+        data = memoryview(content.encode('utf-8'))
+        end = len(data) if end is None else min(end, len(data))
+        for offset in range(start, end, self.CHUNK_SIZE):
+            yield data[offset:min(offset + self.CHUNK_SIZE, end)]
+    
+    def _iter_disk(self, file_path, start, end):
+        """Читает диапазон байт файла с диска кусками по CHUNK_SIZE"""
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = None if end is None else max(end - start, 0)
+            while remaining is None or remaining > 0:
+                size = self.CHUNK_SIZE if remaining is None else min(self.CHUNK_SIZE, remaining)
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+    
+    def head_offset(self, node, lines):
+        """Смещение конца первых lines строк файла"""
+        content = node.content
+        if content is None:
+            # Файл не прочитан: считаем переводы строк, читая с начала кусками
+            offset = 0
+            for chunk in self._iter_disk(node.path, 0, None):
+                pos = -1
+                while lines > 0:
+                    pos = chunk.find(b'\n', pos + 1)
+                    if pos < 0:
+                        break
+                    lines -= 1
+                if lines <= 0:
+                    return offset + pos + 1
+                offset += len(chunk)
+            return offset
+        
+        newline = '\n' if isinstance(content, str) else b'\n'
+        offset = 0
+        for _ in range(lines):
+            pos = content.find(newline, offset)
+            if pos < 0:
+                return len(content)
+            offset = pos + 1
+        return offset
+    
+    def tail_offset(self, node, lines):
+        """Смещение начала последних lines строк файла (поиск идёт с конца)"""
+        content = node.content
+        if content is None:
+            return self._tail_offset_disk(node.path, lines)
+        
+        newline = '\n' if isinstance(content, str) else b'\n'
+        limit = len(content)
+        if lines <= 0:
+            return limit
+        # Завершающий перевод строки не начинает новую строку
+        if content[limit - 1:limit] == newline:
+            limit -= 1
+        for _ in range(lines):
+            pos = content.rfind(newline, 0, limit)
+            if pos < 0:
+                return 0
+            limit = pos
+        return limit + 1
+    
+    def _tail_offset_disk(self, file_path, lines):
+        """tail_offset для непрочитанного файла: блоки читаются с конца файла назад"""
+        with open(file_path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if lines <= 0:
+                return size
+            position = size
+            skip_last = True
+            while position > 0:
+                block_start = max(position - self.CHUNK_SIZE, 0)
+                f.seek(block_start)
+                block = f.read(position - block_start)
+                limit = len(block)
+                if skip_last:
+                    # Завершающий перевод строки не начинает новую строку
+                    skip_last = False
+                    if block.endswith(b'\n'):
+                        limit -= 1
+                while True:
+                    pos = block.rfind(b'\n', 0, limit)
+                    if pos < 0:
+                        break
+                    lines -= 1
+                    if lines == 0:
+                        return block_start + pos + 1
+                    limit = pos
+                position = block_start
+            return 0
+    
+    def normalize_path(self, path, cwd="/"):
+        """Приводит путь к абсолютному виду: относительные пути считаются от cwd,
+        "~" означает корень VFS, ".", ".." и повторные "/" допускаются в любом месте"""
+        if path == "~" or path.startswith("~/"):
+            path = "/" + path[1:]
+        elif not path.startswith("/"):
+            path = f"{cwd}/{path}"
+        
+        parts = []
+        for part in path.split('/'):
+            if part == '..':
+                if parts:
+                    parts.pop()
+            elif part and part != '.':
+                parts.append(part)
+        return "/" + "/".join(parts)
+    
+    def resolve(self, path, cwd="/"):
+        """Возвращает (нормализованный путь, узел или None)"""
+        path = self.normalize_path(path, cwd)
+        return path, self.get_node(path)
     
     def get_node(self, path="/"):
-        """Возвращает узел по пути"""
+        """Возвращает узел по пути. Найденные узлы хранятся в LRU-кэше
+        по нормализованному пути, поэтому повторный поиск не обходит дерево"""
+        cache = self._path_cache
+        entry = cache.get(path)
+        if entry is None:
+            path = self.normalize_path(path)
+            entry = cache.get(path)
+        if entry is not None:
+            node, checked = entry
+            if checked == self.version or self._still_valid(path, checked):
+                try:
+                    cache.move_to_end(path)
+                except KeyError:
+                    pass  # Запись только что вытеснил другой поток
+                return self._ensure_loaded(node)
+            cache.pop(path, None)
+        
+        # Версия берётся до обхода: если дерево поменяется во время него,
+        # запись будет сверена с этими изменениями при следующем попадании
+        version = self.version
+        node = self._walk(path)
+        if node is not None:
+            cache[path] = (node, version)
+            if len(cache) > self.PATH_CACHE_SIZE:
+                try:
+                    cache.popitem(last=False)
+                except KeyError:
+                    pass
+        return node
+    
+    def _still_valid(self, path, checked):
+        """Сверяет запись кэша, проверенную на версии checked, с инвалидациями после неё.
+        Если ни одна не задела path, запись получает новую версию и дальше проверяется за O(1)"""
+        log = self._invalidations
+        if not log or log[0][0] > checked + 1:
+            return False  # Часть инвалидаций после checked уже забыта
+        newest = checked
+        for version, invalidated, prefix in log:
+            if version > checked and (path == invalidated or path.startswith(prefix)):
+                return False
+            newest = max(newest, version)
+        entry = self._path_cache.get(path)
+        if entry is not None:
+            self._path_cache[path] = (entry[0], newest)
+        return True
+    
+    def _walk(self, path):
+        """Находит узел по нормализованному пути, спускаясь от корня"""
         if path == "/":
-            return self.filesystem
+            return self._ensure_loaded(self.filesystem)
         
         parts = path.strip('/').split('/')
         current = self.filesystem
         
         for part in parts:
-            if part in current['content']:
-                current = current['content'][part]
-            else:
+            if current.type != 'directory':
+                return None
+            self._ensure_loaded(current)
+            current = current.content.get(part)
+            if current is None:
                 return None
-        return current
+        return self._ensure_loaded(current)
     
-    def rm(self, path):
-        """Удаляет файл или директорию из VFS"""
+    def _invalidate(self, path):
+        """Помечает устаревшими записи кэша путей для узла path и всего его поддерева.
+        Кэш не просматривается: инвалидация попадает в короткий журнал, а записи
+        сверяются с ним при попадании в get_node"""
+        version = self.version + 1
+        entry = (version, path, path.rstrip('/') + '/')
+        self._invalidations = (self._invalidations + (entry,))[-self.INVALIDATION_LOG:]
+        self.version = version
+    
+    def _split(self, path):
+        """Делит нормализованный путь на (путь родителя, имя)"""
+        parent_path, _, name = path.rpartition('/')
+        return parent_path or "/", name
+    
+    @writer
+    def rm(self, path, recursive=False):
+        """Удаляет файл или директорию из VFS; с recursive — вместе с содержимым"""
+        path = self.normalize_path(path)
         if path == "/":
             return False, "Cannot remove root directory"
         
-        parts = path.strip('/').split('/')
-        filename = parts[-1]
-        parent_path = "/" + "/".join(parts[:-1])
+        parent_path, filename = self._split(path)
         
         parent_node = self.get_node(parent_path)
-        if not parent_node:
+        if not parent_node or parent_node.type != 'directory':
             return False, f"Parent directory not found: {parent_path}"
         
-        if filename not in parent_node['content']:
+        node = parent_node.content.get(filename)
+        if node is None:
             return False, f"File or directory not found: {path}"
         
-        node = parent_node['content'][filename]
-        
         # Проверяем, не является ли директория пустой
-        if node['type'] == 'directory' and node['content']:
-            return False, f"Directory not empty: {path}"
+        if not recursive:
+            self._ensure_loaded(node)
+            if node.type == 'directory' and node.content:
+                return False, f"Directory not empty: {path}"
         
-        # Удаляем узел
-        del parent_node['content'][filename]
+        # Удаляем узел (поддерево отцепляется целиком, без обхода)
+        self._record_edit(path, node, owned=True)
+        self._detach(parent_node, filename, path)
+        if self.journal is not None:
+            self.journal.append('rm', path)
         return True, f"Removed: {path}"
     
+    def _detach(self, parent, name, path):
+        """Отцепляет ребёнка name от parent вместе с итогами, индексами и кэшем путей"""
+        content = dict(parent.content)
+        node = content.pop(name)
+        parent.content = content
+        node.parent = None
+        size, count = self._totals(node)
+        self._add_totals(parent, -size, -count)
+        self._unindex_subtree(node)
+        self._invalidate(path)
+        return node
+    
+    def _attach(self, parent, name, node, path):
+        """Вставляет готовый узел (с поддеревом) в parent под именем name"""
+        content = dict(parent.content)
+        content[name] = node
+        parent.content = content
+        self._add_totals(parent, *self._totals(node))
+        self._index_subtree(node)
+        self._invalidate(path)
+    
+    def _target(self, source, destination):
+        """Куда положить source при cp/mv в destination.
+        Возвращает (директория-приёмник, имя, путь) или (None, сообщение, None)"""
+        node = self.get_node(destination)
+        if node is not None and node.type == 'directory':
+            # Копируем/перемещаем внутрь существующей директории
+            parent, name = node, self._split(source)[1]
+            destination = f"{destination.rstrip('/')}/{name}"
+        else:
+            parent_path, name = self._split(destination)
+            parent = self.get_node(parent_path)
+            if parent is None or parent.type != 'directory':
+                return None, f"Directory not found: {parent_path}", None
+        
+        existing = parent.content.get(name)
+        if existing is not None and (existing.type == 'directory' or
+                                     self.get_node(source).type == 'directory'):
+            return None, f"Already exists: {destination}", None
+        return parent, name, destination
+    
+    @writer
+    def mv(self, source, destination):
+        """Перемещает файл или директорию. Поддерево не копируется:
+        узел перецепляется к новому родителю за O(1)"""
+        source = self.normalize_path(source)
+        destination = self.normalize_path(destination)
+        if source == "/":
+            return False, "Cannot move root directory"
+        
+        node = self.get_node(source)
+        if node is None:
+            return False, f"File or directory not found: {source}"
+        
+        parent, name, target_path = self._target(source, destination)
+        if parent is None:
+            return False, name
+        if parent.content.get(name) is node:
+            return True, f"Moved: {source} -> {target_path}"
+        
+        # Нельзя переместить директорию внутрь неё самой
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is node:
+                return False, f"Cannot move {source} into itself"
+            ancestor = ancestor.parent
+        
+        # Узел запоминает свой физический путь: непрочитанные файлы
+        # и незагруженные директории по-прежнему читаются из исходного места
+        if node.origin is None:
+            node.origin = node.path
+        if self.journal is not None:
+            self.journal.moved.add(node)
+            self.journal.append('mv', source, target_path)
+        self._record_edit(source, node, owned=True)
+        self._record_edit(target_path, parent.content.get(name), owned=True)
+        size, count = self._totals(node)
+        self._remove_existing(parent, name)
+        self._add_totals(node.parent, -size, -count)
+        old_parent = node.parent
+        content = dict(old_parent.content)
+        del content[node.name]
+        if old_parent is not parent:
+            old_parent.content = content
+            content = dict(parent.content)
+        self._index_discard(node, content=False)
+        node.parent = parent
+        node.name = name
+        content[name] = node
+        parent.content = content
+        self._index_add(node, content=False)
+        self._add_totals(parent, size, count)
+        
+        self._invalidate(source)
+        self._invalidate(target_path)
+        return True, f"Moved: {source} -> {target_path}"
+    
+    @writer
+    def cp(self, source, destination, recursive=False):
+        """Копирует файл или (с recursive) директорию.
+        Содержимое файлов не дублируется: копия ссылается на тот же неизменяемый
+        объект (str или mmap), то есть копирование работает как copy-on-write"""
+        source = self.normalize_path(source)
+        destination = self.normalize_path(destination)
+        
+        node = self.get_node(source)
+        if node is None:
+            return False, f"File or directory not found: {source}"
+        if node.type == 'directory' and not recursive:
+            return False, f"Is a directory (use -r): {source}"
+        
+        parent, name, target_path = self._target(source, destination)
+        if parent is None:
+            return False, name
+        
+        # Нельзя скопировать директорию внутрь неё самой
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is node:
+                return False, f"Cannot copy {source} into itself"
+            ancestor = ancestor.parent
+        
+        if self.journal is not None:
+            # Копия не должна читаться из исходного места: к моменту чтения оно
+            # может быть уже удалено или перемещено на диске
+            self._read_subtree(node)
+            self.journal.append('cp', source, target_path)
+        copy = self._copy_node(node, name, parent)
+        self._record_edit(target_path, parent.content.get(name), owned=True)
+        self._remove_existing(parent, name)
+        self._attach(parent, name, copy, target_path)
+        return True, f"Copied: {source} -> {target_path}"
+    
+    def _remove_existing(self, parent, name):
+        """Убирает из итогов файл, который будет заменён при cp/mv"""
+        existing = parent.content.get(name)
+        if existing is not None:
+            self._add_totals(parent, -existing.size, -1)
+            self._index_discard(existing)
+            existing.parent = None
+    
+    def _read_subtree(self, node):
+        """Догружает поддерево и читает содержимое всех его файлов"""
+        self.load_subtree(node)
+        for current in self._iter_subtree(node):
+            if current.type == 'file' and current.content is None:
+                self.read_file(current)
+    
+    def _copy_node(self, node, name, parent):
+        """Копия узла и его поддерева с общим содержимым файлов"""
+        if node.type == 'file':
+            # Для непрочитанного файла копия помнит, откуда его читать
+            origin = node.path if node.content is None else None
+            copy = FileNode(name, parent, node.permissions, node.owner, node.group,
+                            node.content, node.size, origin)
+            copy.mtime = node.mtime
+            return copy
+        
+        copy = DirNode(name, parent, node.permissions, node.owner, node.group)
+        copy.mtime = node.mtime
+        if not node.loaded:
+            # Незагруженная директория будет прочитана из исходного места
+            copy.origin = node.path
+            copy.loaded = False
+            return copy
+        for child_name, child in node.content.items():
+            copy.content[child_name] = self._copy_node(child, child_name, copy)
+        copy.total_size = node.total_size
+        copy.file_count = node.file_count
+        return copy
+    
+    @writer
     def chmod(self, path, mode):
         """Изменяет права доступа файла или директории"""
         node = self.get_node(path)
@@ -158,12 +1355,310 @@ class VFS:
                     mode = int(mode, 8)  # Предполагаем восьмеричное число без префикса
             
             # Устанавливаем новые права доступа
-            node['permissions'] = mode
+            path = self.normalize_path(path)
+            self._record_edit(path, node)
+            self._set_permissions(node, mode)
+            if self.journal is not None:
+                self.journal.append('chmod', path, mode)
             return True, f"Changed permissions of {path} to {oct(mode)}"
         
         except ValueError:
             return False, f"Invalid mode format: {mode}"
     
+    def _set_permissions(self, node, mode):
+        self._index_discard(node, content=False)
+        node.permissions = mode
+        self._index_add(node, content=False)
+    
+    def _record_edit(self, path, node=None, owned=False):
+        """Запоминает, что path изменён в памяти, и mtime, который был у него на диске.
+        owned — содержимое пути теперь принадлежит VFS (rm, цель cp/mv) и refresh в него не спускается.
+        В режиме write-back изменения уходят на диск, и refresh сверяется уже с ним"""
+        if self.journal is not None:
+            return
+        record = self.edits.get(path)
+        if record is not None:
+            self.edits[path] = (record[0] or owned, record[1])
+            return
+        if node is not None and node.mtime is not None:
+            mtime = node.mtime
+        else:
+            mtime = self._disk_mtime(path)
+        self.edits[path] = (owned, mtime)
+    
+    def _disk_mtime(self, path):
+        """mtime физического файла, соответствующего пути VFS, или None, если его нет"""
+        if self.physical_path is None:
+            return None
+        try:
+            return os.stat(os.path.join(self.physical_path, path.lstrip('/'))).st_mtime_ns
+        except OSError:
+            return None
+    
+    @writer
+    def refresh(self):
+        """Сверяет загруженное дерево с физической директорией по mtime и размеру.
+        Перечитываются только изменившиеся файлы и появившиеся поддеревья;
+        незагруженные (ленивые) директории пропускаются — они и так будут прочитаны с диска.
+        Пути, изменённые в памяти, не перезаписываются: если на диске они тоже изменились,
+        путь попадает в conflicts (о каждом изменении сообщается один раз).
+        Возвращает словарь со счётчиками added, removed, updated и списками conflicts, errors"""
+        report = {'added': 0, 'removed': 0, 'updated': 0, 'conflicts': [], 'errors': []}
+        if self.physical_path is None:
+            return report
+        if self.journal is not None:
+            self.journal.sync()
+        
+        # Незагруженный корень (ленивый режим до первой команды) сверять не с чем
+        stack = [(self.filesystem, "/", self.physical_path)] if self.filesystem.loaded else []
+        while stack:
+            node, path, physical = stack.pop()
+            try:
+                with os.scandir(physical) as entries:
+                    disk = {entry.name: entry for entry in entries}
+            except OSError as e:
+                report['errors'].append(f"{path}: {e}")
+                continue
+            
+            prefix = path.rstrip('/') + '/'
+            # Изменения директории собираются в новый словарь детей и применяются разом:
+            # одна подмена content, одно обновление итогов предков и одна инвалидация кэша
+            changes = DirChanges(self, node)
+            for name, entry in disk.items():
+                child_path = prefix + name
+                child = node.content.get(name)
+                try:
+                    stat_info = entry.stat()
+                    is_dir = entry.is_dir()
+                except OSError as e:
+                    report['errors'].append(f"{child_path}: {e}")
+                    continue
+                
+                if child_path in self.edits:
+                    owned = self._check_conflict(child_path, stat_info.st_mtime_ns, report)
+                    # После chmod директории её содержимое по-прежнему сверяется с диском
+                    if not owned and is_dir and child is not None and child.type == 'directory' and child.loaded:
+                        stack.append((child, child_path, entry.path))
+                    continue
+                
+                if child is None:
+                    changes.add(name, self._load_entry(name, node, is_dir))
+                    report['added'] += 1
+                elif (child.type == 'directory') != is_dir:
+                    changes.remove(name)
+                    changes.add(name, self._load_entry(name, node, is_dir))
+                    report['updated'] += 1
+                elif is_dir:
+                    child.mtime = stat_info.st_mtime_ns
+                    if stat_info.st_mode & 0o777 != child.permissions:
+                        self._set_permissions(child, stat_info.st_mode & 0o777)
+                        report['updated'] += 1
+                    if child.loaded:
+                        stack.append((child, child_path, entry.path))
+                elif (child.mtime != stat_info.st_mtime_ns or
+                      child.size != stat_info.st_size):
+                    self._reload_file(child, stat_info)
+                    report['updated'] += 1
+                elif stat_info.st_mode & 0o777 != child.permissions:
+                    self._set_permissions(child, stat_info.st_mode & 0o777)
+                    report['updated'] += 1
+            
+            for name in [name for name in node.content if name not in disk]:
+                child_path = prefix + name
+                if child_path in self.edits:
+                    self._check_conflict(child_path, None, report)
+                elif any(edited.startswith(child_path + '/') for edited in self.edits):
+                    # Удалено на диске, но внутри есть изменения в памяти — оставляем
+                    self.edits[child_path] = (True, None)
+                    report['conflicts'].append(child_path)
+                else:
+                    changes.remove(name)
+                    report['removed'] += 1
+            
+            if changes.content is not None:
+                node.content = changes.content
+                self._add_totals(node, changes.size, changes.count)
+                self._invalidate(path)
+        return report
+    
+    def _check_conflict(self, path, mtime, report):
+        """Сравнивает mtime изменённого в памяти пути с тем, что был при изменении.
+        Возвращает признак owned из записи"""
+        owned, recorded = self.edits[path]
+        if mtime != recorded:
+            report['conflicts'].append(path)
+            self.edits[path] = (owned, mtime)
+        return owned
+    
+    def _load_entry(self, name, parent, is_dir):
+        if is_dir:
+            return self._load_directory(name, parent)
+        return self._load_file(name, parent)
+    
+    def _reload_file(self, node, stat_info):
+        """Перечитывает изменившийся на диске файл; непрочитанный файл остаётся непрочитанным"""
+        old_size = node.size
+        self._index_discard(node)
+        node.permissions = stat_info.st_mode & 0o777
+        node.owner = stat_info.st_uid
+        node.group = stat_info.st_gid
+        node.mtime = stat_info.st_mtime_ns
+        if node.content is None:
+            node.size = stat_info.st_size
+        else:
+            try:
+                node.content, node.size = self._read_file(node.path)
+            except PermissionError:
+                self._mark_unreadable(node, '[PERMISSION DENIED]')
+            except Exception as e:
+                self._mark_unreadable(node, f'[ERROR: {str(e)}]')
+        self._index_add(node)
+        self._add_totals(node.parent, node.size - old_size, 0)
+    
+    # Формат снимка VFS (little-endian):
+    #   заголовок  — SNAPSHOT_HEADER: сигнатура, флаги, число узлов, длина пути корня
+    #                и смещения таблицы узлов, блока имён и блока данных;
+    #   путь корня — UTF-8;
+    #   таблица    — node_count записей SNAPSHOT_RECORD фиксированного размера
+    #                в прямом порядке обхода (родитель всегда раньше детей),
+    #                поэтому запись i читается по смещению без разбора остальных;
+    #   имена      — имена и исходные физические пути узлов подряд;
+    #   данные     — содержимое файлов в UTF-8 подряд.
+    SNAPSHOT_MAGIC = b'VFSSNAP1'
+    SNAPSHOT_HEADER = struct.Struct('<8sIIIQQQ')
+    # kind, parent, permissions, owner, group, name_off, name_len,
+    # origin_off, origin_len, size, data_off, data_len
+    SNAPSHOT_RECORD = struct.Struct('<BIIIIIHIHQQQ')
+    SNAPSHOT_NO_PARENT = 0xFFFFFFFF
+    SNAPSHOT_FLAG_LAZY = 1
+    # Виды узлов в таблице снимка
+    KIND_DIR, KIND_FILE, KIND_DIR_UNLOADED, KIND_FILE_UNREAD = range(4)
+    
+    @writer
+    def save_snapshot(self, snapshot_path):
+        """Сохраняет текущее дерево VFS (вместе с изменениями rm/chmod) в бинарный снимок.
+        Обход идёт под блокировкой писателей, чтобы снимок не застал дерево между двумя директориями"""
+        records = []
+        names = bytearray()
+        data = bytearray()
+        # Обход в прямом порядке: индекс родителя всегда известен к моменту записи ребёнка
+        stack = [(self.filesystem, self.SNAPSHOT_NO_PARENT)]
+        while stack:
+            node, parent_index = stack.pop()
+            index = len(records)
+            
+            name = node.name.encode('utf-8', 'surrogateescape')
+            name_off = len(names)
+            names += name
+            if node.origin is not None and node.parent is not None:
+                origin = node.origin.encode('utf-8', 'surrogateescape')
+                origin_off = len(names)
+                names += origin
+            else:
+                origin, origin_off = b'', 0
+            
+            data_off = data_len = size = 0
+            if node.type == 'directory':
+                kind = self.KIND_DIR if node.loaded else self.KIND_DIR_UNLOADED
+            elif node.content is None or isinstance(node.content, mmap.mmap):
+                # Отображённые файлы не копируются в снимок и снова читаются с диска
+                kind = self.KIND_FILE_UNREAD
+                size = node.size
+            else:
+                kind = self.KIND_FILE
+                size = node.size
+                content = node.content.encode('utf-8', 'surrogateescape')
+                data_off, data_len = len(data), len(content)
+                data += content
+            
+            records.append(self.SNAPSHOT_RECORD.pack(
+                kind, parent_index, node.permissions, node.owner, node.group,
+                name_off, len(name), origin_off, len(origin), size, data_off, data_len))
+            
+            if node.type == 'directory':
+                # Кладём детей в обратном порядке, чтобы сохранить порядок ls
+                for child in reversed(list(node.content.values())):
+                    stack.append((child, index))
+        
+        root_path = os.path.abspath(self.physical_path).encode('utf-8', 'surrogateescape')
+        table_off = self.SNAPSHOT_HEADER.size + len(root_path)
+        names_off = table_off + len(records) * self.SNAPSHOT_RECORD.size
+        data_off = names_off + len(names)
+        flags = self.SNAPSHOT_FLAG_LAZY if self.lazy else 0
+        
+        tmp_path = f"{snapshot_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, flags, len(records), len(root_path),
+                                              table_off, names_off, data_off))
+            f.write(root_path)
+            f.write(b''.join(records))
+            f.write(names)
+            f.write(data)
+        os.replace(tmp_path, snapshot_path)
+        return len(records)
+    
+    def _load_snapshot(self, snapshot_path):
+        """Восстанавливает дерево VFS из снимка без обхода физической директории"""
+        with open(snapshot_path, 'rb') as f:
+            blob = f.read()
+        
+        header = self.SNAPSHOT_HEADER
+        if len(blob) < header.size:
+            raise ValueError(f"Not a VFS snapshot: {snapshot_path}")
+        magic, flags, node_count, root_len, table_off, names_off, data_off = header.unpack_from(blob)
+        if magic != self.SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a VFS snapshot: {snapshot_path}")
+        
+        root_path = blob[header.size:header.size + root_len].decode('utf-8', 'surrogateescape')
+        if self.physical_path is None:
+            self.physical_path = root_path
+        if flags & self.SNAPSHOT_FLAG_LAZY:
+            self.lazy = True
+        
+        view = memoryview(blob)
+        names = view[names_off:data_off]
+        data = view[data_off:]
+        table = view[table_off:table_off + node_count * self.SNAPSHOT_RECORD.size]
+        nodes = []
+        for (kind, parent_index, permissions, owner, group, name_off, name_len,
+             origin_off, origin_len, size, content_off, content_len) in self.SNAPSHOT_RECORD.iter_unpack(table):
+            name = str(names[name_off:name_off + name_len], 'utf-8', 'surrogateescape')
+            if parent_index == self.SNAPSHOT_NO_PARENT:
+                parent = None
+                origin = self.physical_path
+            else:
+                parent = nodes[parent_index]
+                origin = str(names[origin_off:origin_off + origin_len], 'utf-8', 'surrogateescape') if origin_len else None
+            
+            if kind == self.KIND_DIR or kind == self.KIND_DIR_UNLOADED:
+                node = DirNode(name, parent, permissions, owner, group, origin)
+                node.loaded = kind == self.KIND_DIR
+            elif kind == self.KIND_FILE:
+                content = str(data[content_off:content_off + content_len], 'utf-8', 'surrogateescape')
+                node = FileNode(name, parent, permissions, owner, group, content, size, origin)
+            else:
+                node = FileNode(name, parent, permissions, owner, group, None, size, origin)
+            
+            if parent is not None:
+                parent.content[name] = node
+            nodes.append(node)
+        
+        if not nodes:
+            raise ValueError(f"Empty VFS snapshot: {snapshot_path}")
+        
+        # Итоги директорий: узлы записаны в прямом порядке, поэтому обратный проход
+        # встречает каждого ребёнка раньше его родителя
+        for node in reversed(nodes):
+            parent = node.parent
+            if parent is not None:
+                if node.type == 'directory':
+                    parent.total_size += node.total_size
+                    parent.file_count += node.file_count
+                else:
+                    parent.total_size += node.size
+                    parent.file_count += 1
+        return nodes[0]
+    
     def _format_permissions(self, mode):
         """Форматирует права доступа в строку вида 'rwxr-xr--'"""
         perm_str = ''
@@ -178,15 +1673,471 @@ class VFS:
         perm_str += 'x' if mode & 0o001 else '-'
         return perm_str
 
-class Terminal:
+class CommandLog:
+    """Журнал команд в CSV (timestamp,user,command,status,duration_us).
+    Строка пишется после выполнения команды: status — её настоящий результат,
+    duration_us — время выполнения в микросекундах.
+    Файл держится открытым, строки копятся в буфере и записываются пакетом:
+    при накоплении flush_rows строк, раз в flush_interval секунд (фоновый поток
+    сбрасывает буфер и когда команд больше нет), при exit и при завершении
+    интерпретатора. Если задан max_bytes, файл
+    ротируется: log.csv -> log.csv.1 -> ... -> log.csv.<backups>"""
+    HEADER = ["timestamp", "user", "command", "status", "duration_us"]
+    FLUSH_ROWS = 256
+    BACKUPS = 3
+    FLUSH_INTERVAL = 1.0
+    # never — сброс только в ОС, flush — fsync при каждом сбросе буфера,
+    # always — сброс и fsync после каждой строки
+    FSYNC_POLICIES = ('never', 'flush', 'always')
+    
+    def __init__(self, path, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, fsync='never',
+                 max_bytes=0, backups=BACKUPS):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes  # 0 — без ротации
+        self.backups = backups
+        self.rotations = 0
+        self.rows = []
+        self.written = 0  # Сколько строк уже записано в файл (без заголовка)
+        self.last_flush = time.monotonic()
+        self._second = None  # Секунда, для которой уже отформатирована метка времени
+        self._timestamp = ''
+        # Буфер и файл трогают и команды, и поток сброса по интервалу
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        
+        self._open()
+        atexit.register(self.close)
+        self._start_flusher()
+    
+    def _start_flusher(self):
+        """Запускает поток, который сбрасывает буфер по интервалу, пока команды не приходят"""
+        if self.flush_interval > 0:
+            threading.Thread(target=self._flush_idle, name="log-flusher", daemon=True).start()
+    
+    def _flush_idle(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self.rows and time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.flush()
+    
+    def _open(self):
+        """Создаем файл с заголовком"""
+        import csv
+        
+        self.file = open(self.path, 'w', encoding='UTF-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.HEADER)
+        self.file.flush()
+    
+    def _rotate(self):
+        """Сдвигает архивные файлы журнала и начинает новый"""
+        self.file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self.rotations += 1
+        self._open()
+    
+    def timestamp(self):
+        """Метка времени с точностью до секунды; форматируется один раз в секунду"""
+        second = int(time.time())
+        if second != self._second:
+            self._second = second
+            self._timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        return self._timestamp
+    
+    def write(self, user, command, status, duration_us):
+        """Добавляет строку в буфер и при необходимости сбрасывает его"""
+        self._append((self.timestamp(), user, command, status, duration_us))
+    
+    def write_row(self, row):
+        """Добавляет готовую строку журнала (например, из сессии другого процесса)"""
+        self._append(row)
+    
+    def _append(self, row):
+        with self._lock:
+            self.rows.append(row)
+            if (self.fsync == 'always' or len(self.rows) >= self.flush_rows
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+    
+    def flush(self):
+        """Записывает накопленные строки в файл"""
+        with self._lock:
+            if self.file.closed:
+                return
+            if self.rows:
+                self.writer.writerows(self.rows)
+                self.written += len(self.rows)
+                self.rows.clear()
+            self.file.flush()
+            if self.fsync != 'never':
+                os.fsync(self.file.fileno())
+            self.last_flush = time.monotonic()
+            if self.max_bytes and self.file.tell() >= self.max_bytes:
+                self._rotate()
+    
+    def close(self):
+        """Сбрасывает буфер и закрывает файл"""
+        self._closed.set()
+        with self._lock:
+            if not self.file.closed:
+                self.flush()
+                self.file.close()
+        atexit.unregister(self.close)
+    
+    def stats(self):
+        """Счётчики журнала для команды log-stats"""
+        return {
+            'mode': 'sync',
+            'written': self.written,
+            'buffered': len(self.rows),
+            'rotations': self.rotations,
+        }
+
+
+class AsyncCommandLog(CommandLog):
+    """Журнал команд, который пишет отдельный поток.
+    get_command только кладёт строку в ограниченную очередь; при переполнении
+    действует политика backpressure:
+      block — ждать места в очереди,
+      drop  — отбросить строку (учитывается только в log-stats),
+      count — отбросить строку и записать в журнал строку DROPPED с числом потерь"""
+    QUEUE_SIZE = 10000
+    BACKPRESSURE_POLICIES = ('block', 'drop', 'count')
+    
+    def __init__(self, path, queue_size=QUEUE_SIZE, backpressure='block', **kwargs):
+        if backpressure not in self.BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        import queue
+        self._full = queue.Full
+        self._empty = queue.Empty
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.backpressure = backpressure
+        self.dropped = 0
+        self._unreported = 0  # Потери, ещё не записанные строкой DROPPED
+        self._dropped_user = None  # Пользователь последней потерянной строки (для DROPPED при close)
+        self.max_depth = 0
+        super().__init__(path, **kwargs)
+        self.thread = threading.Thread(target=self._drain, name="log-writer", daemon=True)
+        self.thread.start()
+    
+    def write(self, user, command, status, duration_us):
+        """Кладёт строку в очередь писателя"""
+        row = (self.timestamp(), user, command, status, duration_us)
+        if self.backpressure == 'block':
+            self.queue.put(row)
+        else:
+            if self._unreported and self.backpressure == 'count':
+                try:
+                    self.queue.put_nowait(self._dropped_row(user))
+                    self._unreported = 0
+                except self._full:
+                    pass
+            try:
+                self.queue.put_nowait(row)
+            except self._full:
+                self.dropped += 1
+                self._unreported += 1
+                self._dropped_user = user
+                return
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+    
+    def _dropped_row(self, user):
+        return (self.timestamp(), user, f"[{self._unreported} log records dropped]", "DROPPED", 0)
+    
+    def write_row(self, row):
+        self.queue.put(row)
+    
+    def _start_flusher(self):
+        # Простаивающую очередь по интервалу сбрасывает сам поток-писатель (_drain)
+        pass
+    
+    def _drain(self):
+        """Поток-писатель: забирает строки из очереди и пишет их пакетами"""
+        while True:
+            try:
+                row = self.queue.get(timeout=self.flush_interval)
+            except self._empty:
+                # Очередь простаивает — сбрасываем накопленное по интервалу
+                if self.rows:
+                    self.flush()
+                continue
+            if row is None:
+                self.flush()
+                return
+            self._append(row)
+    
+    def close(self):
+        """Дожидается записи всей очереди и закрывает файл.
+        Потери, после которых строк уже не было, записываются строкой DROPPED здесь"""
+        if self.thread.is_alive():
+            if self._unreported and self.backpressure == 'count':
+                self.queue.put(self._dropped_row(self._dropped_user))
+                self._unreported = 0
+            self.queue.put(None)
+            self.thread.join()
+        super().close()
+    
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'mode': f'async ({self.backpressure})',
+            'queue depth': self.queue.qsize(),
+            'max queue depth': self.max_depth,
+            'queue size': self.queue.maxsize,
+            'dropped': self.dropped,
+        })
+        return stats
+
+class MemoryCommandLog:
+    """Журнал сессии, выполняемой в отдельном процессе (--jobs): строки копятся
+    в памяти и после завершения скрипта передаются в журнал родителя"""
     
     def __init__(self):
-        self.user = os.getenv('USER') or 'user'
-        self.vfs = None
+        self.rows = []
+    
+    def write(self, user, command, status, duration_us):
+        self.rows.append((time.strftime('%Y-%m-%d %H:%M:%S'), user, command, status, duration_us))
+    
+    def close(self):
+        pass
+    
+    def stats(self):
+        return {'mode': 'session', 'buffered': len(self.rows)}
+
+class Profiler:
+    """Профилировщик команд (--profile): число вызовов и задержки каждой команды
+    (p50/p95/p99), а также время, проведённое внутри VFS.get_node, Session.logger
+    и вывода. Задержки хранятся целиком, по 8 байт на выполненную команду.
+    Выполняемая команда запоминается для каждого потока отдельно, поэтому
+    команды --serve могут идти параллельно в пуле потоков"""
+    SECTIONS = ('get_node', 'logger', 'print')
+    
+    def __init__(self, out=None, cprofile=None):
+        self.out = out  # Куда записать JSON при выходе (--profile-out)
+        self.cprofile_out = cprofile  # Куда записать статистику cProfile (--profile-cprofile)
+        self.latencies = {}  # Имя команды -> array('d') длительностей в секундах
+        self.sections = {}  # Имя команды -> {секция: [вызовов, секунд]}
+        self._local = threading.local()  # current: команда, выполняемая в этом потоке
+        self._lock = threading.Lock()
+        self.cprofile = None
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        atexit.register(self.close)
+    
+    def attach(self, vfs):
+        """Подменяет get_node у экземпляра VFS на версию с замером времени"""
+        if not hasattr(vfs.get_node, 'profiler'):
+            vfs.get_node = self.wrap('get_node', vfs.get_node)
+    
+    def wrap(self, section, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(section, time.perf_counter() - started)
+        timed.profiler = self
+        return timed
+    
+    @property
+    def current(self):
+        return getattr(self._local, 'current', None)
+    
+    def begin(self, name):
+        self._local.current = name
+    
+    def end(self, seconds):
+        current = self.current
+        with self._lock:
+            samples = self.latencies.get(current)
+            if samples is None:
+                samples = self.latencies[current] = array('d')
+            samples.append(seconds)
+        self._local.current = None
+    
+    def add(self, section, seconds):
+        """Добавляет время секции к выполняемой команде (вне команд не считается)"""
+        current = self.current
+        if current is None:
+            return
+        with self._lock:
+            sections = self.sections.get(current)
+            if sections is None:
+                sections = self.sections[current] = {}
+            totals = sections.get(section)
+            if totals is None:
+                totals = sections[section] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += seconds
+    
+    @staticmethod
+    def percentile(ordered, fraction):
+        """Перцентиль по методу ближайшего ранга"""
+        return ordered[max(0, min(len(ordered) - 1, int(len(ordered) * fraction + 0.999999) - 1))]
+    
+    def report(self):
+        """Сводка по командам: микросекунды для задержек, миллисекунды для сумм"""
+        report = {}
+        for name, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            total = sum(ordered)
+            sections = self.sections.get(name, {})
+            spent = sum(sections.get(section, (0, 0.0))[1] for section in self.SECTIONS)
+            report[name] = {
+                'calls': len(ordered),
+                'total_ms': total * 1000,
+                'p50_us': self.percentile(ordered, 0.50) * 1_000_000,
+                'p95_us': self.percentile(ordered, 0.95) * 1_000_000,
+                'p99_us': self.percentile(ordered, 0.99) * 1_000_000,
+                'max_us': ordered[-1] * 1_000_000,
+                'sections': {section: {'calls': sections[section][0], 'total_ms': sections[section][1] * 1000}
+                             for section in self.SECTIONS if section in sections},
+                # Остальное время: разбор строки и сам обработчик
+                'handler_ms': max(0.0, total - spent) * 1000,
+            }
+        return report
+    
+    def format(self):
+        """Таблица для команды stats"""
+        lines = [f"{'command':<12} {'calls':>7} {'total ms':>10} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}"
+                 f" {'handler ms':>10} {'get_node ms':>11} {'logger ms':>9} {'print ms':>9}"]
+        for name, row in self.report().items():
+            sections = row['sections']
+            lines.append(f"{name:<12} {row['calls']:>7} {row['total_ms']:>10.3f} {row['p50_us']:>9.1f}"
+                         f" {row['p95_us']:>9.1f} {row['p99_us']:>9.1f} {row['handler_ms']:>10.3f}"
+                         + ''.join(f" {sections.get(section, {}).get('total_ms', 0.0):>{width}.3f}"
+                                   for section, width in zip(self.SECTIONS, (11, 9, 9))))
+        return lines
+    
+    def close(self):
+        """Записывает результаты при выходе (вызывается один раз через atexit)"""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            if self.cprofile_out:
+                self.cprofile.dump_stats(self.cprofile_out)
+            self.cprofile = None
+        if self.out:
+            import json
+            with open(self.out, 'w', encoding='utf-8') as f:
+                json.dump(self.report(), f, indent=2)
+            self.out = None
+
+# Таблицы команд: имя команды -> обработчик(terminal, argv).
+# VFS_COMMANDS действуют при загруженной VFS, BASIC_COMMANDS — без неё
+VFS_COMMANDS = {}
+BASIC_COMMANDS = {}
+# Команды VFS, которые меняют дерево: они выполняются под блокировкой VFS,
+# остальные (ls, cat, pwd, ...) — без неё
+WRITE_COMMANDS = set()
+
+def command(*names, vfs=True, writes=False):
+    """Декоратор: регистрирует обработчик под именами names.
+    Имя "$" обрабатывает все команды вида $VARIABLE"""
+    def register(handler):
+        table = VFS_COMMANDS if vfs else BASIC_COMMANDS
+        for name in names:
+            table[name] = handler
+            if writes:
+                WRITE_COMMANDS.add(name)
+        return handler
+    return register
+
+class ClientStream(io.RawIOBase):
+    """Вывод команды, выполняемой в пуле потоков --serve, в соединение asyncio.
+    Каждый записанный кусок передаётся в цикл событий и ждёт writer.drain(),
+    поэтому медленный клиент тормозит только свою команду, а вывод идёт по кускам,
+    не накапливаясь целиком в памяти"""
+    
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        import asyncio
+        
+        data = bytes(data)
+        asyncio.run_coroutine_threadsafe(self._send(data), self.loop).result()
+        return len(data)
+    
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+
+class Result:
+    """Результат Session.execute: вывод команды, признак ошибки и длительность"""
+    __slots__ = ('output', 'error', 'duration_us', 'exit')
+    
+    def __init__(self, output, error, duration_us, exit=False):
+        self.output = output
+        self.error = error
+        self.duration_us = duration_us
+        self.exit = exit  # Команда exit: сессию нужно закрыть
+    
+    def __repr__(self):
+        return f"Result(error={self.error}, duration_us={self.duration_us}, output={self.output!r})"
+
+
+class Session:
+    """Состояние одного пользователя терминала: текущий путь, флаг ошибки,
+    имя пользователя и журнал. VFS (и журнал) можно разделять между любым
+    числом сессий, поэтому создание сессии не загружает дерево заново.
+    Команды выполняются через execute(line), который возвращает вывод, а не печатает его"""
+    __slots__ = ('vfs', 'user', 'current_vfs_path', 'error_flag', 'log', 'grep_workers', 'out', 'profiler')
+    
+    def __init__(self, vfs=None, user=None, log=None, grep_workers=0, out=None, profiler=None):
+        self.user = user or os.getenv('USER') or 'user'
+        self.vfs = vfs
         self.current_vfs_path = "/"
         self.error_flag = False
+        self.log = log  # CommandLog, если задан --logfile
+        self.grep_workers = grep_workers  # Число процессов для grep по большим деревьям
+        self.out = out  # Куда печатает вывод команд (None — sys.stdout)
+        self.profiler = profiler  # Profiler, если задан --profile
+        if profiler is not None and vfs is not None:
+            profiler.attach(vfs)
+    
+    def print(self, *args, **kwargs):
+        if self.profiler is None:
+            print(*args, file=self.out, **kwargs)
+            return
+        started = time.perf_counter()
+        print(*args, file=self.out, **kwargs)
+        self.profiler.add('print', time.perf_counter() - started)
+    
+    def execute(self, line):
+        """Выполняет команду и возвращает Result с её выводом"""
+        import io
         
-        self.get_arguments()
+        buffer = io.StringIO()
+        out, self.out = self.out, buffer
+        started = time.perf_counter()
+        exited = False
+        try:
+            self.get_command(line)
+        except SystemExit:
+            exited = True
+        finally:
+            self.out = out
+        return Result(buffer.getvalue(), self.error_flag, int((time.perf_counter() - started) * 1_000_000), exited)
         
     def get_prompt(self):
         """Формирует приглашение с учетом VFS"""
@@ -204,297 +2155,1070 @@ class Terminal:
         if not command:
             return
             
-        # Логируем команду
-        try:
-            self.logger(f"{datetime.now().replace(microsecond=0)} | {self.user} | {command}")
-        except:
-            pass
-
         # Обработка команды exit
         if command == "exit":
-            exit()
+            # Журнал может быть общим для нескольких сессий и закрывается при выходе интерпретатора
+            if self.log:
+                self.logger(command, 0)
+            raise SystemExit
         
-        # Если VFS загружена, команды ls, cd, cat работают с VFS
-        if self.vfs:
-            if command == "ls":
-                self.vfs_ls()
-            elif command.startswith("ls "):
-                path = command[3:].strip()
-                self.vfs_ls(path)
-            elif command == "cd":
-                print("cd: missing operand")
+        profiler = self.profiler
+        started = time.perf_counter()
+        try:
+            # Строка разбирается один раз, обработчик ищется по имени в таблице команд.
+            # Если VFS загружена, команды ls, cd, cat работают с VFS
+            argv = command.split()
+            name = "$" if argv[0].startswith("$") else argv[0]
+            handler = (VFS_COMMANDS if self.vfs else BASIC_COMMANDS).get(name)
+            if profiler is not None:
+                profiler.begin(name if handler is not None else "(unknown)")
+            if handler is None:
+                self.print(f"Command not found: {command}")
                 self.error_flag = True
-            elif command.startswith("cd "):
-                path = command[3:].strip()
-                self.vfs_cd(path)
-            elif command == "pwd":
-                print(self.current_vfs_path)
-            elif command.startswith("cat "):
-                path = command[4:].strip()
-                self.vfs_cat(path)
-            elif command == "vfs-info":
-                self.vfs_info()
-            elif command.startswith("rm "):
-                path = command[3:].strip()
-                self.vfs_rm(path)
-            elif command.startswith("chmod "):
-                parts = command[6:].split()
-                if len(parts) == 2:
-                    mode, path = parts
-                    self.vfs_chmod(path, mode)
+            elif self.vfs and name in WRITE_COMMANDS:
+                with self.vfs.lock:
+                    handler(self, argv)
+            else:
+                handler(self, argv)
+        except BaseException:
+            # Прерванная (например, Ctrl+C) команда записывается в журнал как ошибка
+            self.error_flag = True
+            raise
+        finally:
+            # Логируем команду после выполнения — с настоящим статусом и длительностью
+            if self.log:
+                duration_us = int((time.perf_counter() - started) * 1_000_000)
+                if profiler is None:
+                    self.logger(command, duration_us)
                 else:
-                    print("chmod: missing operand")
-                    self.error_flag = True
+                    logged = time.perf_counter()
+                    self.logger(command, duration_us)
+                    profiler.add('logger', time.perf_counter() - logged)
+            if profiler is not None and profiler.current is not None:
+                profiler.end(time.perf_counter() - started)
+
+    # Команды VFS
+
+    @command("ls")
+    def _cmd_ls(self, argv):
+        if len(argv) == 1:
+            self.vfs_ls()
+        else:
+            self.vfs_ls(" ".join(argv[1:]))
+
+    @command("cd")
+    def _cmd_cd(self, argv):
+        if len(argv) == 1:
+            self.print("cd: missing operand")
+            self.error_flag = True
+        else:
+            self.vfs_cd(" ".join(argv[1:]))
+
+    @command("pwd")
+    def _cmd_pwd(self, argv):
+        self.print(self.current_vfs_path)
+
+    @command("cat")
+    def _cmd_cat(self, argv):
+        if len(argv) > 1 and argv[1] == "--range":
+            if len(argv) > 3:
+                self.vfs_cat_range(" ".join(argv[3:]), argv[2])
             else:
-                print(f"Command not found: {command}")
+                self.print("cat: missing operand")
                 self.error_flag = True
+        elif len(argv) > 1:
+            self.vfs_cat(" ".join(argv[1:]))
         else:
-            # Базовые команды (без VFS)
-            if command.startswith("$"):
-                try:
-                    var_name = command[1:].strip()
-                    print(os.environ.get(var_name, f"Variable {var_name} not found"))
-                except:
-                    print("")
-            elif command.startswith("echo"):
-                if len(command) > 4:
-                    text = command[5:]
-                    if (text.startswith('"') and text.endswith('"')) or (text.startswith("'") and text.endswith("'")):
-                        text = text[1:-1]
-                    print(text)
-                else:
-                    pass
-        
-            elif command.startswith("ls"):
-                print("ls: -a -t -m")
-            
-            elif command.startswith("cd"):
-                if len(command) == 2:
-                    print("cd: missing operand")
-                else:
-                    print("cd: cd")
+            self.print("cat: missing operand")
+            self.error_flag = True
 
-            elif command.startswith("rm"):
-                print("rm: remove files/directories (only works with VFS)")
-            
-            elif command.startswith("chmod"):
-                print("chmod: change permissions (only works with VFS)")
-            
-            else:
-                print(f"Command not found: {command}")
+    @command("head", "tail")
+    def _cmd_head_tail(self, argv):
+        self.vfs_head_tail(argv[0], argv[1:])
+
+    @command("du")
+    def _cmd_du(self, argv):
+        summary = len(argv) > 1 and argv[1] == "-s"
+        paths = argv[2:] if summary else argv[1:]
+        self.vfs_du(" ".join(paths) if paths else ".", summary)
+
+    @command("find")
+    def _cmd_find(self, argv):
+        path = "."
+        options = {}
+        args = argv[1:]
+        if args and not args[0].startswith("-"):
+            path = args.pop(0)
+        while args:
+            option = args.pop(0)
+            if option not in ("-name", "-type", "-perm") or not args:
+                self.print("find: usage: find [path] -name PATTERN [-type f|d] [-perm MODE]")
                 self.error_flag = True
+                return
+            options[option] = args.pop(0).strip("'\"")
+        self.vfs_find(path, options.get("-name"), options.get("-type"), options.get("-perm"))
+
+    @command("grep")
+    def _cmd_grep(self, argv):
+        import shlex
+        try:
+            args = shlex.split(" ".join(argv[1:]))
+        except ValueError as e:
+            self.print(f"grep: {e}")
+            self.error_flag = True
+            return
+        options = set()
+        while args and args[0].startswith("-") and len(args[0]) > 1:
+            options.update(args.pop(0)[1:])
+        if len(args) != 2 or not options <= set("rin"):
+            self.print("grep: usage: grep [-r] [-i] [-n] PATTERN path")
+            self.error_flag = True
+            return
+        self.vfs_grep(args[0], args[1], "r" in options, "i" in options, "n" in options)
+
+    @command("vfs-info")
+    def _cmd_vfs_info(self, argv):
+        self.vfs_info()
+
+    @command("vfs-refresh", writes=True)
+    def _cmd_vfs_refresh(self, argv):
+        self.vfs_refresh()
+
+    @command("vfs-save", writes=True)
+    def _cmd_vfs_save(self, argv):
+        if len(argv) > 1:
+            self.vfs_save(" ".join(argv[1:]))
+        else:
+            self.print("vfs-save: missing operand")
+            self.error_flag = True
+
+    @command("rm", writes=True)
+    def _cmd_rm(self, argv):
+        recursive = len(argv) > 1 and argv[1] in ("-r", "-R", "-rf")
+        paths = argv[2:] if recursive else argv[1:]
+        if paths:
+            self.vfs_rm(" ".join(paths), recursive)
+        else:
+            self.print("rm: missing operand")
+            self.error_flag = True
+
+    @command("cp", writes=True)
+    def _cmd_cp(self, argv):
+        recursive = len(argv) > 1 and argv[1] in ("-r", "-R")
+        paths = argv[2:] if recursive else argv[1:]
+        if len(paths) == 2:
+            self.vfs_cp(paths[0], paths[1], recursive)
+        else:
+            self.print("cp: missing operand")
+            self.error_flag = True
+
+    @command("mv", writes=True)
+    def _cmd_mv(self, argv):
+        if len(argv) == 3:
+            self.vfs_mv(argv[1], argv[2])
+        else:
+            self.print("mv: missing operand")
+            self.error_flag = True
+
+    @command("chmod", writes=True)
+    def _cmd_chmod(self, argv):
+        if len(argv) == 3:
+            mode, path = argv[1:]
+            self.vfs_chmod(path, mode)
+        else:
+            self.print("chmod: missing operand")
+            self.error_flag = True
+
+    @command("sync", writes=True)
+    def _cmd_sync(self, argv):
+        self.vfs_sync()
+
+    @command("log-stats")
+    @command("log-stats", vfs=False)
+    def _cmd_log_stats(self, argv):
+        self.log_stats()
+
+    @command("stats")
+    @command("stats", vfs=False)
+    def _cmd_stats(self, argv):
+        self.profile_stats()
+
+    # Базовые команды (без VFS)
+
+    @command("$", vfs=False)
+    def _cmd_variable(self, argv):
+        var_name = " ".join([argv[0][1:]] + argv[1:]).strip()
+        self.print(os.environ.get(var_name, f"Variable {var_name} not found"))
+
+    @command("echo", vfs=False)
+    def _cmd_echo(self, argv):
+        if len(argv) > 1:
+            text = " ".join(argv[1:])
+            if (text.startswith('"') and text.endswith('"')) or (text.startswith("'") and text.endswith("'")):
+                text = text[1:-1]
+            self.print(text)
+
+    @command("ls", vfs=False)
+    def _cmd_basic_ls(self, argv):
+        self.print("ls: -a -t -m")
+
+    @command("cd", vfs=False)
+    def _cmd_basic_cd(self, argv):
+        if len(argv) == 1:
+            self.print("cd: missing operand")
+        else:
+            self.print("cd: cd")
+
+    @command("rm", vfs=False)
+    def _cmd_basic_rm(self, argv):
+        self.print("rm: remove files/directories (only works with VFS)")
+
+    @command("chmod", vfs=False)
+    def _cmd_basic_chmod(self, argv):
+        self.print("chmod: change permissions (only works with VFS)")
+
+    @command("cp", vfs=False)
+    def _cmd_basic_cp(self, argv):
+        self.print("cp: copy files/directories (only works with VFS)")
+
+    @command("mv", vfs=False)
+    def _cmd_basic_mv(self, argv):
+        self.print("mv: move files/directories (only works with VFS)")
 
     def vfs_ls(self, path="."):
         """Показывает содержимое VFS директории (команда ls)"""
         try:
-            # Определяем целевой путь
-            if path == ".":
-                target_path = self.current_vfs_path
-            elif path.startswith("/"):
-                target_path = path
-            else:
-                target_path = f"{self.current_vfs_path}/{path}".replace("//", "/")
-            
-            # Получаем узел
-            node = self.vfs.get_node(target_path)
+            # Определяем целевой путь и получаем узел
+            target_path, node = self.vfs.resolve(path, self.current_vfs_path)
             
             if not node:
-                print(f"ls: cannot access '{path}': No such file or directory")
+                self.print(f"ls: cannot access '{path}': No such file or directory")
                 self.error_flag = True
                 return
                 
-            if node['type'] != 'directory':
-                print(f"ls: '{path}': Not a directory")
+            if node.type != 'directory':
+                self.print(f"ls: '{path}': Not a directory")
                 self.error_flag = True
                 return
                 
             # Выводим содержимое
-            for name in node['content'].keys():
-                item = node['content'][name]
-                if item['type'] == 'directory':
-                    print(f"\033[94m{name}/\033[0m")  # Синий для папок
+            for name, item in node.content.items():
+                if item.type == 'directory':
+                    self.print(f"\033[94m{name}/\033[0m")  # Синий для папок
                 else:
-                    print(f"\033[92m{name}\033[0m")   # Зеленый для файлов
+                    self.print(f"\033[92m{name}\033[0m")   # Зеленый для файлов
                 
         except Exception as e:
-            print(f"ls error: {e}")
+            self.print(f"ls error: {e}")
             self.error_flag = True
 
     def vfs_cd(self, path):
         """Меняет текущую директорию в VFS (команда cd)"""
         try:
-            if path == "..":
-                # Поднимаемся на уровень выше
-                if self.current_vfs_path == "/":
-                    return
-                parts = self.current_vfs_path.strip('/').split('/')
-                new_path = "/" + "/".join(parts[:-1])
-                if new_path == "":
-                    new_path = "/"
-            elif path == "~":
-                new_path = "/"
-            elif path.startswith("/"):
-                new_path = path
-            else:
-                new_path = f"{self.current_vfs_path}/{path}".replace("//", "/")
-            
             # Проверяем путь
-            node = self.vfs.get_node(new_path)
+            new_path, node = self.vfs.resolve(path, self.current_vfs_path)
             if not node:
-                print(f"cd: no such directory: {path}")
+                self.print(f"cd: no such directory: {path}")
                 self.error_flag = True
                 return
                 
-            if node['type'] != 'directory':
-                print(f"cd: not a directory: {path}")
+            if node.type != 'directory':
+                self.print(f"cd: not a directory: {path}")
                 self.error_flag = True
                 return
                 
             self.current_vfs_path = new_path
             
         except Exception as e:
-            print(f"cd error: {e}")
+            self.print(f"cd error: {e}")
+            self.error_flag = True
+
+    def _get_file_node(self, path, command_name):
+        """Находит файл VFS для cat/head/tail; при ошибке печатает сообщение"""
+        file_path, node = self.vfs.resolve(path, self.current_vfs_path)
+        if not node:
+            self.print(f"{command_name}: {path}: No such file")
+            self.error_flag = True
+            return None
+            
+        if node.type != 'file':
+            self.print(f"{command_name}: {path}: Is a directory")
             self.error_flag = True
+            return None
+        
+        return node
+
+    def _write_chunks(self, chunks):
+        """Пишет куски файла в буферизованный вывод сессии; возвращает последний символ вывода"""
+        out = self.out or sys.stdout
+        profiler = self.profiler
+        last = ''
+        decoder = None  # Для вывода без байтового буфера (StringIO в Session.execute)
+        for chunk in chunks:
+            if not chunk:
+                continue
+            # Чтение куска — работа обработчика, запись — вывод (секция print профилировщика)
+            started = time.perf_counter() if profiler is not None else 0
+            if isinstance(chunk, str):
+                out.write(chunk)
+                last = chunk[-1]
+            else:
+                # Байты (mmap или файл на диске) пишем в нижележащий буфер без декодирования
+                out.flush()
+                if hasattr(out, 'buffer'):
+                    out.buffer.write(chunk)
+                else:
+                    # Символ UTF-8 может быть разрезан границей куска: декодер держит его хвост
+                    if decoder is None:
+                        import codecs
+                        decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+                    out.write(decoder.decode(chunk))
+                last = chr(chunk[-1])
+            if profiler is not None:
+                profiler.add('print', time.perf_counter() - started)
+        if decoder is not None:
+            out.write(decoder.decode(b'', final=True))
+        return last
 
     def vfs_cat(self, path):
         """Показывает содержимое файла (команда cat)"""
         try:
-            if path.startswith("/"):
-                file_path = path
-            else:
-                file_path = f"{self.current_vfs_path}/{path}".replace("//", "/")
-            
-            node = self.vfs.get_node(file_path)
+            node = self._get_file_node(path, "cat")
             if not node:
-                print(f"cat: {path}: No such file")
-                self.error_flag = True
                 return
-                
-            if node['type'] != 'file':
-                print(f"cat: {path}: Is a directory")
-                self.error_flag = True
+            
+            content = self.vfs.read_file(node)
+            if node.content is None and isinstance(content, str):
+                # Файл не удалось прочитать — read_file вернул сообщение об ошибке
+                self.print(content)
+                return
+            
+            self._write_chunks(self.vfs.iter_content(node))
+            self.print()
+            
+        except Exception as e:
+            self.print(f"cat error: {e}")
+            self.error_flag = True
+
+    def vfs_cat_range(self, path, byte_range):
+        """Показывает часть файла start:end (команда cat --range)"""
+        try:
+            start, sep, end = byte_range.partition(':')
+            if not sep:
+                raise ValueError
+            start = int(start) if start else 0
+            end = int(end) if end else None
+            if start < 0 or (end is not None and end < start):
+                raise ValueError
+        except ValueError:
+            self.print(f"cat: invalid range: {byte_range}")
+            self.error_flag = True
+            return
+        
+        try:
+            node = self._get_file_node(path, "cat")
+            if not node:
                 return
-                
-            print(node['content'])
+            
+            self._write_chunks(self.vfs.iter_bytes(node, start, end))
+            self.print()
             
         except Exception as e:
-            print(f"cat error: {e}")
+            self.print(f"cat error: {e}")
             self.error_flag = True
 
-    def vfs_rm(self, path):
-        """Удаляет файл или директорию из VFS (команда rm)"""
+    def vfs_head_tail(self, command_name, args):
+        """Показывает первые или последние строки файла (команды head -n и tail -n)"""
+        lines = 10
+        if len(args) == 3 and args[0] == "-n" and args[1].isdigit():
+            lines = int(args[1])
+            path = args[2]
+        elif len(args) == 1:
+            path = args[0]
+        else:
+            self.print(f"{command_name}: usage: {command_name} [-n N] file")
+            self.error_flag = True
+            return
+        
         try:
-            if path.startswith("/"):
-                full_path = path
+            node = self._get_file_node(path, command_name)
+            if not node:
+                return
+            
+            if command_name == "head":
+                chunks = self.vfs.iter_content(node, 0, self.vfs.head_offset(node, lines))
             else:
-                full_path = f"{self.current_vfs_path}/{path}".replace("//", "/")
+                chunks = self.vfs.iter_content(node, self.vfs.tail_offset(node, lines))
+            if self._write_chunks(chunks) not in ('', '\n'):
+                self.print()
+            
+        except Exception as e:
+            self.print(f"{command_name} error: {e}")
+            self.error_flag = True
+
+    def vfs_rm(self, path, recursive=False):
+        """Удаляет файл или директорию из VFS (команда rm [-r])"""
+        try:
+            full_path = self.vfs.normalize_path(path, self.current_vfs_path)
             
-            success, message = self.vfs.rm(full_path)
-            print(message)
+            success, message = self.vfs.rm(full_path, recursive)
+            self.print(message)
+            if not success:
+                self.error_flag = True
+                
+        except Exception as e:
+            self.print(f"rm error: {e}")
+            self.error_flag = True
+
+    def vfs_cp(self, source, destination, recursive=False):
+        """Копирует файл или директорию в VFS (команда cp [-r])"""
+        try:
+            success, message = self.vfs.cp(self.vfs.normalize_path(source, self.current_vfs_path),
+                                           self.vfs.normalize_path(destination, self.current_vfs_path),
+                                           recursive)
+            self.print(message)
             if not success:
                 self.error_flag = True
                 
         except Exception as e:
-            print(f"rm error: {e}")
+            self.print(f"cp error: {e}")
+            self.error_flag = True
+
+    def vfs_mv(self, source, destination):
+        """Перемещает или переименовывает файл или директорию в VFS (команда mv)"""
+        try:
+            success, message = self.vfs.mv(self.vfs.normalize_path(source, self.current_vfs_path),
+                                           self.vfs.normalize_path(destination, self.current_vfs_path))
+            self.print(message)
+            if not success:
+                self.error_flag = True
+                
+        except Exception as e:
+            self.print(f"mv error: {e}")
             self.error_flag = True
 
     def vfs_chmod(self, path, mode):
         """Изменяет права доступа файла или директории (команда chmod)"""
         try:
-            if path.startswith("/"):
-                full_path = path
-            else:
-                full_path = f"{self.current_vfs_path}/{path}".replace("//", "/")
+            full_path = self.vfs.normalize_path(path, self.current_vfs_path)
             
             success, message = self.vfs.chmod(full_path, mode)
-            print(message)
+            self.print(message)
             if not success:
                 self.error_flag = True
                 
         except Exception as e:
-            print(f"chmod error: {e}")
+            self.print(f"chmod error: {e}")
             self.error_flag = True
 
+    def vfs_du(self, path=".", summary=False):
+        """Показывает размер поддеревьев в байтах (команда du [-s])"""
+        try:
+            full_path, node = self.vfs.resolve(path, self.current_vfs_path)
+            if not node:
+                self.print(f"du: cannot access '{path}': No such file or directory")
+                self.error_flag = True
+                return
+            
+            if node.type != 'directory':
+                self.print(f"{node.size}\t{full_path}")
+                return
+            
+            if self.vfs.lazy:
+                # Итоги точны только для загруженных директорий
+                self.vfs.load_subtree(node)
+            
+            if not summary:
+                # Как в du: сначала поддиректории, затем сама директория
+                lines = []
+                stack = [(node, full_path)]
+                while stack:
+                    current, current_path = stack.pop()
+                    lines.append(f"{current.total_size}\t{current_path}")
+                    for name, child in current.content.items():
+                        if child.type == 'directory':
+                            stack.append((child, f"{current_path.rstrip('/')}/{name}"))
+                for line in reversed(lines):
+                    self.print(line)
+            else:
+                self.print(f"{node.total_size}\t{full_path}")
+            
+        except Exception as e:
+            self.print(f"du error: {e}")
+            self.error_flag = True
+
+    def vfs_find(self, path=".", name=None, node_type=None, mode=None):
+        """Ищет файлы и директории по имени, типу и правам (команда find)"""
+        types = {None: None, 'f': 'file', 'd': 'directory'}
+        if node_type not in types:
+            self.print(f"find: unknown type: {node_type}")
+            self.error_flag = True
+            return
+        try:
+            permissions = int(mode, 8) if mode is not None else None
+        except ValueError:
+            self.print(f"find: invalid mode: {mode}")
+            self.error_flag = True
+            return
+        
+        try:
+            full_path = self.vfs.normalize_path(path, self.current_vfs_path)
+            results = self.vfs.find(full_path, name, types[node_type], permissions)
+            if results is None:
+                self.print(f"find: '{path}': No such file or directory")
+                self.error_flag = True
+                return
+            
+            for result in results:
+                self.print(result)
+            
+        except Exception as e:
+            self.print(f"find error: {e}")
+            self.error_flag = True
+
+    def vfs_grep(self, pattern, path, recursive=False, ignore_case=False, line_numbers=False):
+        """Ищет строки по регулярному выражению (команда grep [-r] [-i] [-n])"""
+        import re
+        
+        try:
+            full_path = self.vfs.normalize_path(path, self.current_vfs_path)
+            success, result = self.vfs.grep(full_path, pattern, recursive, ignore_case, self.grep_workers)
+            if not success:
+                self.print(f"grep: {result}")
+                self.error_flag = True
+                return
+            
+            for file_path, number, line in result:
+                prefix = f"{file_path}:" if recursive else ""
+                if line_numbers:
+                    prefix += f"{number}:"
+                self.print(f"{prefix}{line}")
+            
+        except re.error as e:
+            self.print(f"grep: invalid pattern: {e}")
+            self.error_flag = True
+        except Exception as e:
+            self.print(f"grep error: {e}")
+            self.error_flag = True
+
+    def vfs_refresh(self, quiet=False):
+        """Подтягивает изменения физической директории (команда vfs-refresh).
+        С quiet ничего не печатает, если изменений нет (фоновый режим)"""
+        try:
+            started = time.perf_counter()
+            with self.vfs.lock:
+                report = self.vfs.refresh()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            changed = report['added'] or report['removed'] or report['updated']
+            if quiet and not changed and not report['conflicts'] and not report['errors']:
+                return
+            
+            self.print(f"VFS refreshed in {elapsed_ms:.1f} ms: {report['added']} added, "
+                  f"{report['removed']} removed, {report['updated']} updated")
+            for path in report['conflicts']:
+                self.print(f"Conflict: {path} changed on disk and in the VFS; keeping the VFS version")
+            for message in report['errors']:
+                self.print(f"vfs-refresh: {message}")
+        except Exception as e:
+            self.print(f"vfs-refresh error: {e}")
+            self.error_flag = True
+
+    def vfs_sync(self):
+        """Записывает накопленные изменения VFS на диск (команда sync)"""
+        journal = self.vfs.journal
+        if journal is None:
+            self.print("Write-back is disabled")
+            return
+        try:
+            count = journal.sync()
+            self.print(f"Synced {count} operations to {journal.root}")
+            errors = journal.take_errors()
+            for message in errors:
+                self.print(f"sync: {message}")
+            if errors:
+                self.error_flag = True
+        except Exception as e:
+            self.print(f"sync error: {e}")
+            self.error_flag = True
+
+    def vfs_save(self, path):
+        """Сохраняет VFS в бинарный снимок (команда vfs-save)"""
+        try:
+            count = self.vfs.save_snapshot(path)
+            self.print(f"VFS saved to: {path} ({count} nodes)")
+        except Exception as e:
+            self.print(f"vfs-save error: {e}")
+            self.error_flag = True
+
+    def log_stats(self):
+        """Показывает состояние журнала команд (команда log-stats)"""
+        if not self.log:
+            self.print("Logging is disabled")
+            return
+        
+        for name, value in self.log.stats().items():
+            self.print(f"{name}: {value}")
+
+    def profile_stats(self):
+        """Показывает задержки команд, собранные профилировщиком (команда stats)"""
+        if self.profiler is None:
+            self.print("Profiling is disabled (use --profile)")
+            return
+        
+        for line in self.profiler.format():
+            self.print(line)
+
     def vfs_info(self):
         """Показывает информацию о VFS"""
         if not self.vfs:
-            print("VFS not loaded")
+            self.print("VFS not loaded")
             return
             
-        print(f"VFS source: {self.vfs.physical_path}")
-        print(f"Current VFS path: {self.current_vfs_path}")
-        print("Use 'ls' to see contents, 'cd' to navigate, 'cat' to view files")
+        root = self.vfs.filesystem
+        self.print(f"VFS source: {self.vfs.physical_path}")
+        self.print(f"Current VFS path: {self.current_vfs_path}")
+        self.print(f"Total: {root.file_count} files, {root.total_size} bytes"
+              + (" (loaded directories only)" if self.vfs.lazy else ""))
+        if self.vfs.journal is not None:
+            stats = self.vfs.journal.stats()
+            self.print(f"Write-back: {stats['pending']} pending, {stats['applied']} applied, {stats['errors']} errors")
+        self.print("Use 'ls' to see contents, 'cd' to navigate, 'cat' to view files")
+
+    def logger(self, command, duration_us):
+        """Логирует выполненную команду"""
+        try:
+            if self.log:
+                status = "ERROR" if self.error_flag else "SUCCESS"
+                self.log.write(self.user, command, status, duration_us)
+        except Exception as e:
+            self.print(f"Logging error: {e}")
+
+
+class Terminal(Session):
+    """Интерактивный терминал: разбирает аргументы командной строки, загружает VFS,
+    выполняет стартовые скрипты и запускает REPL"""
+    # Размер буфера вывода в пакетном режиме
+    BATCH_BUFFER = 1024 * 1024
+    
+    def __init__(self):
+        super().__init__()
+        self.batch = False  # --batch: скрипт без эха команд и без интерактивного режима
+        self.continue_on_error = False
+        self.serve_address = None  # --serve: unix:/path или tcp:host:port
+        
+        self.get_arguments()
 
     def get_arguments(self):
+        import argparse
+        
         parser = argparse.ArgumentParser()
         parser.add_argument('--logfile', '-l', help="Path to log file")
-        parser.add_argument('--script', '-s', help="Path to script")
+        parser.add_argument('--log-flush-rows', type=int, default=CommandLog.FLUSH_ROWS,
+                            help="Write buffered log rows after this many commands")
+        parser.add_argument('--log-flush-interval', type=float, default=CommandLog.FLUSH_INTERVAL,
+                            help="Write buffered log rows at least this often (seconds)")
+        parser.add_argument('--log-fsync', choices=CommandLog.FSYNC_POLICIES, default='never',
+                            help="fsync policy for the log file")
+        parser.add_argument('--log-max-bytes', type=int, default=0,
+                            help="Rotate the log file when it grows past this size (0 disables)")
+        parser.add_argument('--log-backups', type=int, default=CommandLog.BACKUPS,
+                            help="Number of rotated log files to keep")
+        parser.add_argument('--log-async', action='store_true',
+                            help="Write the log from a background thread")
+        parser.add_argument('--log-queue-size', type=int, default=AsyncCommandLog.QUEUE_SIZE,
+                            help="Maximum number of queued log rows in --log-async mode")
+        parser.add_argument('--log-backpressure', choices=AsyncCommandLog.BACKPRESSURE_POLICIES,
+                            default='block', help="What to do when the log queue is full")
+        parser.add_argument('--profile', action='store_true',
+                            help="Record per-command call counts and latencies (see the stats command)")
+        parser.add_argument('--profile-out',
+                            help="Write profiling results as JSON here on exit (implies --profile)")
+        parser.add_argument('--profile-cprofile', metavar='PATH',
+                            help="Also run cProfile and write its stats here on exit (implies --profile)")
+        parser.add_argument('--script', '-s', nargs='+', help="Path to script (several scripts run in isolated sessions)")
+        parser.add_argument('--jobs', '-j', type=int, default=1,
+                            help="Run up to N scripts at the same time")
+        parser.add_argument('--serve', metavar='ADDRESS',
+                            help="Serve terminal sessions over unix:/path or tcp:host:port instead of the REPL")
+        parser.add_argument('--batch', action='store_true',
+                            help="Run the script without echoing commands, buffer output and exit")
+        parser.add_argument('--continue-on-error', action='store_true',
+                            help="Keep running the script after a failed command")
         parser.add_argument('--vfs', help="Path to Virtual File System")
+        parser.add_argument('--vfs-lazy', action='store_true',
+                            help="Read VFS directories and files on first access")
+        parser.add_argument('--vfs-background', action='store_true',
+                            help="Start at once and load the VFS in a background thread")
+        parser.add_argument('--vfs-workers', type=int, default=0,
+                            help="Load VFS with N parallel worker threads")
+        parser.add_argument('--vfs-snapshot', help="Restore VFS from a snapshot saved with vfs-save")
+        parser.add_argument('--vfs-mmap-threshold', type=int, default=VFS.MMAP_THRESHOLD,
+                            help="Memory-map VFS files of at least this many bytes (0 disables)")
+        parser.add_argument('--vfs-refresh-interval', type=float, default=0,
+                            help="Pick up changes from the VFS directory every N seconds in the background")
+        parser.add_argument('--vfs-writeback', action='store_true',
+                            help="Apply rm, chmod, cp and mv to the VFS directory on disk in batches")
+        parser.add_argument('--vfs-writeback-interval', type=float, default=WritebackJournal.INTERVAL,
+                            help="How often the write-back thread applies queued changes (seconds)")
+        parser.add_argument('--grep-index', action='store_true',
+                            help="Narrow literal grep searches with a trigram index")
+        parser.add_argument('--grep-workers', type=int, default=0,
+                            help="Spread grep over N processes on large trees")
         
         args = parser.parse_args()
+        self.grep_workers = args.grep_workers
+        self.batch = args.batch
+        self.continue_on_error = args.continue_on_error
+        self.serve_address = args.serve
 
-        if args.vfs:
+        if args.vfs or args.vfs_snapshot:
             try:
-                self.vfs = VFS(args.vfs)
-                print(f"VFS loaded successfully from: {args.vfs}")
+                self.vfs = VFS(args.vfs, lazy=args.vfs_lazy, workers=args.vfs_workers,
+                               snapshot=args.vfs_snapshot, mmap_threshold=args.vfs_mmap_threshold,
+                               grep_index=args.grep_index, writeback=args.vfs_writeback,
+                               writeback_interval=args.vfs_writeback_interval, background=args.vfs_background)
+                print(f"VFS loaded successfully from: {args.vfs_snapshot or args.vfs}")
                 print("Commands ls, cd, cat, pwd, rm, chmod now work with VFS")
+                if args.vfs_refresh_interval > 0:
+                    threading.Thread(target=self._refresh_loop, args=(args.vfs_refresh_interval,),
+                                     daemon=True).start()
             except Exception as e:
                 print(f"Error loading VFS: {e}")
                 print("Running without VFS support")
                 
         # Обработка logfile
         if args.logfile:
-            self.log_path = args.logfile
-            # Создаем файл с заголовком
-            with open(self.log_path, 'w', encoding='UTF-8', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["timestamp", "user", "command", "status"])
+            options = dict(flush_rows=args.log_flush_rows, flush_interval=args.log_flush_interval,
+                           fsync=args.log_fsync, max_bytes=args.log_max_bytes, backups=args.log_backups)
+            if args.log_async:
+                self.log = AsyncCommandLog(args.logfile, queue_size=args.log_queue_size,
+                                           backpressure=args.log_backpressure, **options)
+            else:
+                self.log = CommandLog(args.logfile, **options)
+        
+        if args.profile or args.profile_out or args.profile_cprofile:
+            self.profiler = Profiler(out=args.profile_out, cprofile=args.profile_cprofile)
+            if self.vfs is not None:
+                self.profiler.attach(self.vfs)
         
         # Обработка script
         if args.script:
-            if os.path.exists(args.script):
-                self.start_script = args.script
+            missing = [path for path in args.script if not os.path.exists(path)]
+            for path in missing:
+                print(f"Script not found: {path}")
+            scripts = [path for path in args.script if path not in missing]
+            if len(args.script) == 1 and scripts:
+                self.start_script = scripts[0]
                 print(f"Executing script: {self.start_script}")
                 self.execute_script()
-            else:
-                print(f"Script not found: {args.script}")
-        
-        # Обработка VFS
-        
+            elif scripts:
+                self.execute_scripts(scripts, args.jobs)
+            if missing:
+                self.error_flag = True
 
     def execute_script(self):
-        """Выполняет команды из скрипта"""
+        """Выполняет команды из скрипта.
+        В пакетном режиме (--batch) приглашение и команда не печатаются, весь вывод
+        идёт через один буферизованный writer, а в конце печатается сводка"""
+        if self.batch:
+            import io
+            from contextlib import redirect_stdout
+            out = io.TextIOWrapper(open(sys.stdout.fileno(), 'wb', buffering=self.BATCH_BUFFER, closefd=False),
+                                   encoding=sys.stdout.encoding, errors='replace')
+            sys.stdout.flush()
+            try:
+                with redirect_stdout(out):
+                    errors = self._run_script()[1]
+            finally:
+                out.flush()
+            # Код возврата пакетного запуска: были ли ошибки во всём скрипте
+            self.error_flag = errors > 0
+        else:
+            self._run_script()
+
+    def _run_script(self, exit_ends_script=False):
+        """Выполняет self.start_script. Возвращает (строк, ошибок, секунд, состояние),
+        состояние — ok, errors, stopped или exit. Команда exit завершает процесс,
+        а с exit_ends_script — только скрипт"""
+        lines = errors = 0
+        state = "ok"
+        started = time.perf_counter()
         try:
             with open(self.start_script, 'r', encoding='utf-8') as file:
                 for line in file:
                     line = line.strip()
                     if line and not line.startswith('#'):
-                        print(f"{self.get_prompt()}{line}")
+                        lines += 1
+                        if not self.batch:
+                            print(f"{self.get_prompt()}{line}")
                         self.get_command(line)
                         if self.error_flag:
-                            print("Script stopped due to error")
-                            break
-            print("Script execution completed")
+                            errors += 1
+                            state = "errors"
+                            if not self.continue_on_error:
+                                print("Script stopped due to error")
+                                state = "stopped"
+                                break
+            if not self.batch:
+                print("Script execution completed")
+        except SystemExit:
+            state = "exit"
+            if not exit_ends_script:
+                raise
         except Exception as e:
             print(f"Error executing script: {e}")
+            state = "failed"
+        finally:
+            # Сводка печатается и тогда, когда скрипт завершился командой exit
+            if self.batch:
+                print(f"Script completed: {lines} lines, {errors} errors, "
+                      f"{time.perf_counter() - started:.3f} s")
+        return lines, errors, time.perf_counter() - started, state
+
+    def execute_scripts(self, paths, jobs=1):
+        """Выполняет несколько скриптов, каждый в своей сессии: дочерний процесс
+        получает копию VFS при fork (copy-on-write), собственные current_vfs_path
+        и error_flag и не видит изменений других скриптов. Вывод каждого скрипта
+        собирается отдельно и печатается по порядку, затем — сводная таблица"""
+        import tempfile
+        import pickle
+        
+        print(f"Executing {len(paths)} scripts ({jobs} at a time)")
+        if self.log:
+            self.log.flush()
+        sys.stdout.flush()
+        
+        results = [None] * len(paths)
+        outputs = [tempfile.TemporaryFile() for _ in paths]
+        running = {}  # pid -> (номер скрипта, файл результата)
+        queue = list(enumerate(paths))
+        while queue or running:
+            while queue and len(running) < max(jobs, 1):
+                index, path = queue.pop(0)
+                result_file = tempfile.TemporaryFile()
+                if hasattr(os, 'fork'):
+                    pid = self._fork()
+                    if pid == 0:
+                        self._script_session(path, outputs[index], result_file)
+                    running[pid] = (index, result_file)
+                else:
+                    # Без fork скрипты выполняются по очереди в этом процессе и делят VFS
+                    self._script_session(path, outputs[index], result_file, fork=False)
+                    result_file.seek(0)
+                    results[index] = pickle.load(result_file)
+            if running:
+                pid, status = os.wait()
+                index, result_file = running.pop(pid)
+                result_file.seek(0)
+                try:
+                    results[index] = pickle.load(result_file)
+                except (EOFError, pickle.UnpicklingError):
+                    results[index] = (0, 0, 0.0, "crashed", [])
+                result_file.close()
+        
+        for path, output, (lines, errors, elapsed, state, rows) in zip(paths, outputs, results):
+            print(f"==> {path} <==")
+            output.seek(0)
+            sys.stdout.flush()
+            sys.stdout.buffer.write(output.read())
+            sys.stdout.buffer.flush()
+            output.close()
+            if self.log:
+                for row in rows:
+                    self.log.write_row(row)
+        
+        width = max(len("Script"), *(len(path) for path in paths))
+        print(f"{'Script':<{width}}  {'Lines':>7}  {'Errors':>6}  {'Status':<8}  {'Time':>9}")
+        for path, (lines, errors, elapsed, state, rows) in zip(paths, results):
+            print(f"{path:<{width}}  {lines:>7}  {errors:>6}  {state:<8}  {elapsed:>7.3f} s")
+        if any(result[1] for result in results):
+            self.error_flag = True
+
+    def _fork(self):
+        """fork под блокировкой VFS: иначе дочерний процесс может унаследовать её
+        занятой фоновым потоком (загрузка, write-back, vfs-refresh), которого в нём нет"""
+        if self.vfs is None:
+            return os.fork()
+        with self.vfs.lock:
+            return os.fork()
 
-    def logger(self, to_write):
-        """Логирует команду"""
+    def _script_session(self, path, output, result_file, fork=True):
+        """Выполняет один скрипт в отдельной сессии и сохраняет в result_file
+        (строк, ошибок, секунд, состояние, строки журнала)"""
+        import pickle
+        from contextlib import redirect_stdout
+        
+        log, self.log = self.log, (MemoryCommandLog() if self.log else None)
+        self.current_vfs_path = "/"
+        self.error_flag = False
+        self.start_script = path
+        if self.vfs is not None and fork:
+            # Поток записи на диск не переживает fork, а сессия изолирована в памяти
+            self.vfs.journal = None
+        
+        result = (0, 0, 0.0, "crashed", [])
+        stream = open(output.fileno(), 'w', encoding='utf-8', errors='replace', closefd=False)
         try:
-            if hasattr(self, 'log_path'):
-                status = "ERROR" if self.error_flag else "SUCCESS"
-                log_data = [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    self.user,
-                    to_write.split('|')[-1].strip() if '|' in to_write else to_write,
-                    status
-                ]
+            with redirect_stdout(stream):
+                result = self._run_script(exit_ends_script=True) + (self.log.rows if self.log else [],)
+        finally:
+            stream.flush()
+            pickle.dump(result, result_file)
+            result_file.flush()
+            if fork:
+                os._exit(0)
+            self.log = log
+
+    def _refresh_loop(self, interval):
+        """Фоновый vfs-refresh раз в interval секунд. Идёт в своей Session,
+        чтобы ошибка сверки не выставляла флаг ошибки интерактивной сессии"""
+        session = Session(self.vfs, user=self.user, out=self.out)
+        while True:
+            time.sleep(interval)
+            session.vfs_refresh(quiet=True)
+
+    # Очередь ожидающих соединений сервера: рассчитана на тысячи клиентов
+    SERVE_BACKLOG = 1024
+    # Потоки, в которых сервер выполняет команды: цикл событий только принимает строки и отдаёт вывод
+    SERVE_WORKERS = 32
+    
+    def serve(self, address):
+        """Сервер сессий на asyncio (--serve unix:/path или tcp:host:port).
+        Каждое соединение получает свою Session (текущий путь, флаг ошибки, пользователь)
+        поверх общей, загруженной один раз VFS. Простаивающее соединение стоит
+        одну корутину, поэтому один поток держит тысячи клиентов; сами команды
+        выполняются в пуле из SERVE_WORKERS потоков"""
+        import asyncio
+        
+        kind, _, target = address.partition(':')
+        if kind not in ('unix', 'tcp') or not target:
+            print(f"Invalid --serve address: {address} (expected unix:/path or tcp:host:port)")
+            self.error_flag = True
+            return
+        
+        bound = []  # Inode созданного нами сокета: в finally удаляем только его
+        
+        async def main():
+            from concurrent.futures import ThreadPoolExecutor
+            
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=self.SERVE_WORKERS, thread_name_prefix='serve'))
+            if kind == 'unix':
+                self._remove_stale_socket(target)
+                server = await asyncio.start_unix_server(self._serve_client, target, backlog=self.SERVE_BACKLOG)
+                bound.append(os.lstat(target).st_ino)
+            else:
+                host, _, port = target.rpartition(':')
+                server = await asyncio.start_server(self._serve_client, host or '127.0.0.1', int(port),
+                                                    backlog=self.SERVE_BACKLOG)
+            print(f"Serving terminal sessions on {address}")
+            sys.stdout.flush()
+            # SIGTERM останавливает сервер так же аккуратно, как Ctrl+C
+            stop = asyncio.Event()
+            try:
+                import signal
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+            except (ImportError, NotImplementedError, AttributeError):
+                pass
+            async with server:
+                await stop.wait()
+            print("Server stopped")
+        
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            print("\nServer stopped")
+        except OSError as e:
+            print(f"Server error: {e}")
+            self.error_flag = True
+        finally:
+            if bound:
+                import stat
                 
-                with open(self.log_path, 'a', encoding='UTF-8', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(log_data)
-        except Exception as e:
-            print(f"Logging error: {e}")
+                try:
+                    info = os.lstat(target)
+                    if stat.S_ISSOCK(info.st_mode) and info.st_ino == bound[0]:
+                        os.remove(target)
+                except OSError:
+                    pass
+
+    def _remove_stale_socket(self, path):
+        """Удаляет сокет, оставшийся от упавшего сервера. Обычный файл или сокет,
+        который ещё принимает соединения, не трогаем — это ошибка адреса"""
+        import errno
+        import socket
+        import stat
+        
+        try:
+            info = os.lstat(path)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(info.st_mode):
+            raise FileExistsError(errno.EEXIST, "File exists and is not a socket", path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.remove(path)
+            return
+        except FileNotFoundError:
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, "Address already in use", path)
+
+    async def _serve_client(self, reader, writer):
+        """Обслуживает одно соединение: строка команды -> вывод и новое приглашение.
+        Команда выполняется в пуле потоков (в том числе ожидание блокировки VFS у rm, mv
+        и т. п.), а её вывод по кускам уходит клиенту, пока она ещё работает"""
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        stream = ClientStream(loop, writer)
+        out = io.TextIOWrapper(io.BufferedWriter(stream, VFS.CHUNK_SIZE),
+                               encoding='utf-8', errors='replace', newline='')
+        session = Session(self.vfs, user=self._peer_user(writer), log=self.log, grep_workers=self.grep_workers,
+                          out=out, profiler=self.profiler)
+        try:
+            writer.write(session.get_prompt().encode('utf-8'))
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if await loop.run_in_executor(None, self._client_command, session, line.decode('utf-8', 'replace')):
+                    break
+                writer.write(session.get_prompt().encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # Клиент отключился или прислал слишком длинную строку
+            pass
+        finally:
+            # Остаток буфера после обрыва соединения уже некуда отправить
+            stream.close()
+            writer.close()
+
+    @staticmethod
+    def _client_command(session, line):
+        """Выполняет команду клиента в потоке пула; возвращает True для exit"""
+        try:
+            session.get_command(line)
+        except SystemExit:
+            return True
+        finally:
+            session.out.flush()
+        return False
+
+    def _peer_user(self, writer):
+        """Имя пользователя клиента unix-сокета (SO_PEERCRED) или пользователь сервера"""
+        sock = writer.get_extra_info('socket')
+        try:
+            import socket
+            import pwd
+            credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+            return pwd.getpwuid(struct.unpack('3i', credentials)[1]).pw_name
+        except (ImportError, AttributeError, OSError, KeyError):
+            return self.user
 
     def run(self):
         print("Terminal emulator started. Type 'exit' to quit.")
@@ -515,4 +3239,9 @@ class Terminal:
 
 if __name__ == "__main__":
     term = Terminal()
-    term.run()
\ No newline at end of file
+    if term.serve_address:
+        term.serve(term.serve_address)
+    elif not term.batch:
+        term.run()
+    elif term.error_flag:
+        sys.exit(1)
\ No newline at end of file